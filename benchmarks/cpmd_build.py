@@ -0,0 +1,83 @@
+##############################################################################
+# Benchmark of the build of CPMD, serially as the package used to and with
+# make -j once the Fortran module dependencies are added to its Makefile.
+#
+# Run it with the repository registered in Spack, the compilers and MPI of
+# the build in PATH:
+#
+#     spack python benchmarks/cpmd_build.py [--jobs N] [--dir DIR]
+#                                           [--output FILE] TREE
+#
+# TREE is a CPMD tree configured for the architecture to build, e.g. the
+# stage of "spack stage cpmd@v4.1" after running ./configure.sh <ARCH> in it.
+# It is copied to DIR, by default a temporary directory, once per build so
+# that both start from scratch. The results are written as JSON.
+##############################################################################
+from __future__ import print_function
+
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from spack.pkg.scitasexternal.cpmd import (add_module_dependencies,
+                                           fortran_sources)
+
+
+def build(tree, make_args):
+    """Runs make in tree with make_args and returns the wall time."""
+    env = dict(os.environ)
+    env.pop('MAKEFLAGS', None)
+    start = time.time()
+    subprocess.check_call(['make'] + make_args, cwd=tree, env=env)
+    return time.time() - start
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description='Times the serial and the parallel build of CPMD')
+    parser.add_argument('--jobs', type=int,
+                        default=multiprocessing.cpu_count(),
+                        help='number of jobs of the parallel build')
+    parser.add_argument('--dir', help='directory to build in')
+    parser.add_argument('--output', help='JSON file to write, or stdout')
+    parser.add_argument('tree', help='configured CPMD tree')
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(dir=args.dir)
+    try:
+        serial = os.path.join(workdir, 'serial')
+        shutil.copytree(args.tree, serial, symlinks=True)
+        serial_time = build(serial, ['-j1'])
+
+        parallel = os.path.join(workdir, 'parallel')
+        shutil.copytree(args.tree, parallel, symlinks=True)
+        rules = add_module_dependencies(
+            os.path.join(parallel, 'Makefile'),
+            fortran_sources(os.path.join(parallel, 'src')))
+        parallel_time = build(parallel, ['-j{0}'.format(args.jobs)])
+    finally:
+        shutil.rmtree(workdir)
+
+    results = {
+        'serial_s': serial_time,
+        'parallel_s': parallel_time,
+        'jobs': args.jobs,
+        'dependency_rules': rules,
+        'speedup': serial_time / parallel_time,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    else:
+        json.dump(results, sys.stdout, indent=2, sort_keys=True)
+        print()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,145 @@
+##############################################################################
+# Benchmark of CRYSTAL17 built against different BLAS and LAPACK providers.
+#
+# Run it with the repository registered in Spack, on a compute node:
+#
+#     spack python benchmarks/crystal17_blas.py [--program NAME]
+#         [--launcher COMMAND] [--threads N] [--repeat N] [--dir DIR]
+#         [--output FILE] --input DECK [--input DECK ...] spec [spec ...]
+#
+# Each spec is an installed crystal17, e.g. "crystal17 ^openblas",
+# "crystal17 ^blis" and "crystal17 %intel ^intel-mkl". Every input deck
+# (.d12) is run with the program of each of them, crystal by default or
+# Pcrystal/MPPcrystal behind --launcher, e.g. "srun -n 32", in a fresh
+# directory of DIR. The threads of OpenMP and of every BLAS are set to
+# --threads. The wall times and the final SCF energy, which should not
+# depend on the provider, are written as JSON.
+##############################################################################
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import re
+import shlex
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import llnl.util.tty as tty
+import spack.cmd
+import spack.store
+
+# Energy of the last SCF cycle in the output of CRYSTAL
+_energy_re = re.compile(r'SCF ENDED.*E\(AU\)\s+(\S+)')
+
+# Variables setting the threads of OpenMP and of the BLAS providers
+_thread_variables = ['OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS',
+                     'MKL_NUM_THREADS', 'BLIS_NUM_THREADS']
+
+
+def installed_spec(spec):
+    """Returns the single installed spec matching spec."""
+    matches = spack.store.db.query(spec, installed=True)
+    if len(matches) != 1:
+        tty.die('{0} matches {1} installed specs, expected one'.format(
+            spec, len(matches)))
+    return matches[0]
+
+
+def run_deck(command, deck, workdir, env):
+    """Runs command on deck in workdir, from which it is cleaned after.
+    Returns the wall time and the final SCF energy, or None if it is not
+    in the output."""
+    os.makedirs(workdir)
+    try:
+        # crystal reads the deck on its standard input, the parallel
+        # programs from INPUT in their working directory
+        shutil.copy(deck, os.path.join(workdir, 'INPUT'))
+        with open(deck) as stdin:
+            start = time.time()
+            output = subprocess.check_output(command, stdin=stdin,
+                                             cwd=workdir, env=env)
+            elapsed = time.time() - start
+    finally:
+        shutil.rmtree(workdir)
+
+    energies = _energy_re.findall(output.decode('utf-8', 'replace'))
+    return elapsed, float(energies[-1]) if energies else None
+
+
+def benchmark(spec, args, workdir):
+    program = os.path.join(spec.prefix.bin, args.program)
+    command = shlex.split(args.launcher or '') + [program]
+    env = dict(os.environ)
+    env.update((variable, str(args.threads))
+               for variable in _thread_variables)
+
+    decks = {}
+    for deck in args.input:
+        name = os.path.basename(deck)
+        timings = []
+        energy = None
+        for index in range(args.repeat):
+            elapsed, energy = run_deck(
+                command, deck, os.path.join(workdir, str(index)), env)
+            timings.append(elapsed)
+        timings.sort()
+        decks[name] = {
+            'best_s': timings[0],
+            'median_s': timings[len(timings) // 2],
+            'energy_au': energy,
+        }
+    return {
+        'blas': '{0}@{1}'.format(spec['blas'].name, spec['blas'].version),
+        'lapack': '{0}@{1}'.format(spec['lapack'].name,
+                                   spec['lapack'].version),
+        'compiler': str(spec.compiler),
+        'decks': decks,
+    }
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description='Times input decks with crystal17 built against '
+                    'different BLAS providers')
+    parser.add_argument('--input', action='append', required=True,
+                        help='input deck to run, may be repeated')
+    parser.add_argument('--program', default='crystal',
+                        help='program to run: crystal, Pcrystal or '
+                             'MPPcrystal')
+    parser.add_argument('--launcher', help='command starting the program, '
+                                           'e.g. "srun -n 32"')
+    parser.add_argument('--threads', type=int, default=1,
+                        help='OpenMP and BLAS threads per process')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='number of runs per deck and spec')
+    parser.add_argument('--dir', help='directory to run in')
+    parser.add_argument('--output', help='JSON file to write, or stdout')
+    parser.add_argument('specs', nargs='+',
+                        help='installed crystal17 specs to compare')
+    args = parser.parse_args(argv)
+
+    specs = [installed_spec(spec)
+             for spec in spack.cmd.parse_specs(args.specs)]
+    workdir = tempfile.mkdtemp(dir=args.dir)
+    try:
+        results = dict(
+            ('{0}/{1}'.format(spec.name, spec.dag_hash(7)),
+             benchmark(spec, args, os.path.join(workdir, spec.dag_hash())))
+            for spec in specs)
+    finally:
+        shutil.rmtree(workdir)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    else:
+        json.dump(results, sys.stdout, indent=2, sort_keys=True)
+        print()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,134 @@
+##############################################################################
+# Benchmark of the import of gurobipy installed by Spack or from the Gurobi
+# distribution unpacked in a home directory.
+#
+# Run it with the Python the module of gurobi+python uses:
+#
+#     spack python benchmarks/gurobipy_import.py [--python PYTHON]
+#         [--spack PREFIX] [--home GUROBI_HOME] [--repeat N] [--output FILE]
+#
+# PREFIX is the prefix of a gurobi+python installation, GUROBI_HOME the
+# linux64 directory of the distribution. Each one is imported in a fresh
+# interpreter, with a fixed environment holding only its PYTHONPATH and
+# LD_LIBRARY_PATH, and timed as a whole and with -X importtime. The results
+# are written as JSON.
+##############################################################################
+from __future__ import print_function
+
+import argparse
+import glob
+import json
+import os
+import subprocess
+import sys
+import time
+
+
+def _with_gurobipy(pattern):
+    """Returns the first directory matching pattern holding gurobipy."""
+    for path in sorted(glob.glob(pattern)):
+        if os.path.exists(os.path.join(path, 'gurobipy')):
+            return os.path.abspath(path)
+    return None
+
+
+def spack_layout(prefix):
+    return (_with_gurobipy(os.path.join(prefix, 'lib', 'python*',
+                                        'site-packages')),
+            os.path.abspath(os.path.join(prefix, 'linux64', 'lib')))
+
+
+def home_layout(gurobi_home):
+    return (_with_gurobipy(os.path.join(gurobi_home, 'lib', 'python*')),
+            os.path.abspath(os.path.join(gurobi_home, 'lib')))
+
+
+def import_times(python, env, repeat):
+    """Imports gurobipy repeat times and returns the sorted wall times."""
+    command = [python, '-c', 'import gurobipy']
+    subprocess.check_call(command, env=env)
+    timings = []
+    for _ in range(repeat):
+        start = time.time()
+        subprocess.check_call(command, env=env)
+        timings.append(time.time() - start)
+    timings.sort()
+    return timings
+
+
+def import_profile(python, env):
+    """Returns the cumulative import time of gurobipy in microseconds and the
+    number of modules it imported, from -X importtime."""
+    output = subprocess.check_output(
+        [python, '-X', 'importtime', '-c', 'import gurobipy'],
+        env=env, stderr=subprocess.STDOUT).decode()
+    modules = 0
+    cumulative = None
+    for line in output.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        fields = [field.strip() for field in line[12:].split('|')]
+        if not fields[1].isdigit():
+            continue
+        modules += 1
+        if fields[2] == 'gurobipy':
+            cumulative = int(fields[1])
+    return cumulative, modules
+
+
+def benchmark(python, site, lib_dir, repeat):
+    env = {
+        'PATH': '/usr/bin:/bin',
+        'PYTHONPATH': site,
+        'LD_LIBRARY_PATH': lib_dir,
+        'PYTHONDONTWRITEBYTECODE': '1',
+    }
+    timings = import_times(python, env, repeat)
+    cumulative, modules = import_profile(python, env)
+    return {
+        'site': site,
+        'best_ms': timings[0] * 1000,
+        'median_ms': timings[len(timings) // 2] * 1000,
+        'gurobipy_import_us': cumulative,
+        'modules': modules,
+    }
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description='Times the import of gurobipy')
+    parser.add_argument('--python', default=sys.executable,
+                        help='Python interpreter to import with')
+    parser.add_argument('--spack', help='prefix of a gurobi+python install')
+    parser.add_argument('--home', help='linux64 directory of the '
+                                       'distribution in a home directory')
+    parser.add_argument('--repeat', type=int, default=20,
+                        help='number of timed imports per installation')
+    parser.add_argument('--output', help='JSON file to write, or stdout')
+    args = parser.parse_args(argv)
+
+    layouts = {}
+    if args.spack:
+        layouts['spack'] = spack_layout(args.spack)
+    if args.home:
+        layouts['home'] = home_layout(args.home)
+    if not layouts:
+        parser.error('give at least one of --spack and --home')
+
+    results = {}
+    for name, (site, lib_dir) in sorted(layouts.items()):
+        if site is None:
+            results[name] = {'error': 'gurobipy not found'}
+            continue
+        results[name] = benchmark(args.python, site, lib_dir, args.repeat)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    else:
+        json.dump(results, sys.stdout, indent=2, sort_keys=True)
+        print()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
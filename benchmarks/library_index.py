@@ -0,0 +1,149 @@
+##############################################################################
+# Benchmark of the start time of a program resolving its shared libraries
+# through a LD_LIBRARY_PATH chain or through a library index.
+#
+# Run it with the repository registered in Spack and a C compiler in PATH:
+#
+#     spack python benchmarks/library_index.py [--repeat N] [--extra-dirs N]
+#                                              [--dir DIR] [--output FILE]
+#
+# Stand-ins for g16 and gurobi_cl are built in DIR, by default a temporary
+# directory, linked against stub libraries spread over as many directories
+# as the real installations have. Each one is started with the directories
+# in LD_LIBRARY_PATH, after --extra-dirs directories standing for the other
+# loaded modules, then with the index of link_library_index in their place.
+# Put DIR on the filesystem to measure, where the cost of a lookup is the
+# one that matters. The results are written as JSON.
+##############################################################################
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from spack.pkg.scitasexternal.binary_payload import link_library_index
+
+# Library directories and number of libraries of each program
+programs = {
+    'g16': {'dirs': 4, 'libs': 24},
+    'gurobi_cl': {'dirs': 1, 'libs': 4},
+}
+
+
+def _compile(args, cwd):
+    subprocess.check_call([os.environ.get('CC', 'cc')] + args, cwd=cwd)
+
+
+def build(root, name, dirs, libs):
+    """Builds the stub libraries of a program in dirs directories and the
+    program linked against all of them. Returns the program and the
+    directories."""
+    lib_dirs = [os.path.join(root, name, 'lib{0}'.format(index))
+                for index in range(dirs)]
+    for lib_dir in lib_dirs:
+        os.makedirs(lib_dir)
+
+    calls = []
+    link = []
+    for index in range(libs):
+        lib_dir = lib_dirs[index % dirs]
+        stem = '{0}_{1}'.format(name, index)
+        source = os.path.join(lib_dir, stem + '.c')
+        with open(source, 'w') as f:
+            f.write('int {0}(void) {{ return {1}; }}\n'.format(stem, index))
+        _compile(['-shared', '-fPIC', '-o', 'lib{0}.so'.format(stem),
+                  source], lib_dir)
+        os.remove(source)
+        calls.append('    total += {0}();'.format(stem))
+        link.extend(['-L' + lib_dir, '-l' + stem])
+
+    source = os.path.join(root, name, 'main.c')
+    with open(source, 'w') as f:
+        f.write(''.join('int {0}_{1}(void);\n'.format(name, index)
+                        for index in range(libs)))
+        f.write('int main(void) {\n    int total = 0;\n')
+        f.write('\n'.join(calls))
+        f.write('\n    return total < 0;\n}\n')
+    program = os.path.join(root, name, name)
+    _compile(['-o', program, source, '-Wl,--no-as-needed'] + link, root)
+    return program, lib_dirs
+
+
+def start_times(program, library_path, repeat):
+    """Starts program repeat times with a fixed environment and returns the
+    sorted wall times."""
+    env = {'PATH': '/usr/bin:/bin', 'LD_LIBRARY_PATH': library_path}
+    subprocess.check_call([program], env=env)
+    timings = []
+    for _ in range(repeat):
+        start = time.time()
+        subprocess.check_call([program], env=env)
+        timings.append(time.time() - start)
+    timings.sort()
+    return timings
+
+
+def summary(timings):
+    return {
+        'best_ms': timings[0] * 1000,
+        'median_ms': timings[len(timings) // 2] * 1000,
+    }
+
+
+def benchmark(root, name, layout, extra_dirs, repeat):
+    program, lib_dirs = build(root, name, layout['dirs'], layout['libs'])
+    index = link_library_index(os.path.join(root, name, 'prefix'), lib_dirs)
+    chain = os.pathsep.join(extra_dirs + lib_dirs)
+    indexed = os.pathsep.join(extra_dirs + [index])
+    return {
+        'lib_dirs': len(lib_dirs),
+        'libraries': layout['libs'],
+        'chain': summary(start_times(program, chain, repeat)),
+        'index': summary(start_times(program, indexed, repeat)),
+    }
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description='Times the start of programs with and without an index '
+                    'of their libraries')
+    parser.add_argument('--repeat', type=int, default=200,
+                        help='number of timed starts per program and setup')
+    parser.add_argument('--extra-dirs', type=int, default=8,
+                        help='number of other directories in LD_LIBRARY_PATH')
+    parser.add_argument('--dir', help='directory to work in')
+    parser.add_argument('--output', help='JSON file to write, or stdout')
+    parser.add_argument('programs', nargs='*',
+                        help='programs to run, all of them by default')
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(dir=args.dir)
+    try:
+        # The directories of the other modules do not have the libraries
+        extra_dirs = [os.path.join(workdir, 'module{0}'.format(index))
+                      for index in range(args.extra_dirs)]
+        for extra_dir in extra_dirs:
+            os.makedirs(extra_dir)
+
+        results = dict(
+            (name, benchmark(workdir, name, programs[name], extra_dirs,
+                             args.repeat))
+            for name in args.programs or sorted(programs))
+    finally:
+        shutil.rmtree(workdir)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    else:
+        json.dump(results, sys.stdout, indent=2, sort_keys=True)
+        print()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,235 @@
+##############################################################################
+# Benchmark of the run environments of the packages in this repository.
+#
+# Run it with the repository registered in Spack:
+#
+#     spack python benchmarks/module_load.py [--repeat N] [--output FILE]
+#                                            [--all-versions] [package ...]
+#
+# Every package is concretized and pointed to a fake prefix holding stubs of
+# its main program and libraries, then its run environment is computed as
+# for a module file, in a fixed environment. The lookups of the program in
+# PATH and of its libraries in LD_LIBRARY_PATH are counted on the stubs.
+# The results are written as JSON, one entry per package, or per version of
+# each package with --all-versions, so that they can be compared between
+# commits. The layouts of all the Ansys releases are timed with:
+#
+#     spack python benchmarks/module_load.py --all-versions ansys
+##############################################################################
+from __future__ import print_function
+
+import argparse
+import contextlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import spack.repo
+import spack.spec
+from spack.util.environment import EnvironmentModifications
+
+namespace = 'scitasexternal'
+
+# The program a user runs first after loading the module, and the
+# directories holding the libraries it loads, relative to the prefix, with
+# {version} the version of the spec. The programs of the packages whose
+# payload is outside of the prefix are None.
+main_programs = {
+    'abaqus': ('code/bin/abaqus', []),
+    'adf': (None, []),
+    'ansys': ('fluent/bin/fluent', ['Framework/bin/Linux64']),
+    'castep': ('bin/castep.mpi', []),
+    'cfdplusplus': ('mlib/mcfd.{version}/exec/mcfd', ['lib']),
+    'comsol': ('bin/comsol', []),
+    'cpmd': ('bin/cpmd.x', []),
+    'crystal17': ('bin/crystal', []),
+    'fdtd': ('bin/fdtd-solutions', []),
+    'gaussian': ('bin/g16', ['g16']),
+    'gurobi': ('bin/gurobi_cl', ['linux64/lib']),
+    'intel-advisor': ('bin64/advixe-cl', []),
+    'intel-vtune': ('bin64/amplxe-cl', []),
+    'maple': (None, []),
+    'mathematica': ('bin/math', []),
+    'molden': ('bin/molden', []),
+    'molpro': ('bin/molpro', []),
+    'terachem': ('TeraChem/bin/terachem', ['TeraChem/lib']),
+    'totalview': ('bin/totalview', []),
+}
+
+# What the variables are set to before the module is loaded
+baseline = {
+    'PATH': '/usr/local/bin:/usr/bin:/bin',
+    'LD_LIBRARY_PATH': '',
+}
+
+
+def _defined_in_repo(cls, name):
+    return any(name in vars(c) for c in cls.__mro__
+               if c.__module__.startswith('spack.pkg.'))
+
+
+def run_environment(pkg):
+    """Returns the modifications of the run environment of a package, with
+    whichever of the old and new APIs it implements."""
+    env = EnvironmentModifications()
+    if _defined_in_repo(type(pkg), 'setup_run_environment'):
+        pkg.setup_run_environment(env)
+    else:
+        pkg.setup_environment(EnvironmentModifications(), env)
+    return env
+
+
+@contextlib.contextmanager
+def fixed_environment():
+    """Runs the block with only the baseline variables in os.environ."""
+    saved = dict(os.environ)
+    try:
+        os.environ.clear()
+        os.environ.update(baseline)
+        yield
+    finally:
+        os.environ.clear()
+        os.environ.update(saved)
+
+
+def applied(env):
+    """Returns the variables of the baseline after the modifications."""
+    with fixed_environment():
+        env.apply_modifications()
+        return dict((name, os.environ.get(name, '')) for name in baseline)
+
+
+def _entries(value):
+    return [entry for entry in value.split(os.pathsep) if entry]
+
+
+def populate(prefix, name, version):
+    """Writes the stubs of the main program and libraries of a package to
+    prefix. Returns the names of the program and of the libraries, None
+    for the program when it is not in the prefix."""
+    program, lib_dirs = main_programs.get(name, (None, []))
+    libraries = []
+    for index, lib_dir in enumerate(lib_dirs):
+        lib_dir = os.path.join(prefix, lib_dir.format(version=version))
+        os.makedirs(lib_dir)
+        libraries.append('libstub{0}.so'.format(index))
+        open(os.path.join(lib_dir, libraries[-1]), 'w').close()
+
+    if program is None:
+        return None, libraries
+    program = os.path.join(prefix, program.format(version=version))
+    if not os.path.isdir(os.path.dirname(program)):
+        os.makedirs(os.path.dirname(program))
+    with open(program, 'w') as f:
+        f.write('#!/bin/sh\n')
+    os.chmod(program, 0o755)
+    return os.path.basename(program), libraries
+
+
+def exec_lookups(path, program):
+    """Returns how many directories of PATH are searched to find program,
+    or None if it is not found."""
+    for count, entry in enumerate(_entries(path), 1):
+        if os.access(os.path.join(entry, program), os.X_OK):
+            return count
+    return None
+
+
+def library_lookups(ld_library_path, library):
+    """Returns how many directories of LD_LIBRARY_PATH are searched to find
+    library, or None if it is not found."""
+    for count, entry in enumerate(_entries(ld_library_path), 1):
+        if os.path.exists(os.path.join(entry, library)):
+            return count
+    return None
+
+
+def benchmark(spec_string, tmpdir, repeat):
+    spec = spack.spec.Spec('{0}.{1}'.format(namespace, spec_string))
+    spec.concretize()
+    spec.prefix = tempfile.mkdtemp(dir=tmpdir)
+    pkg = spec.package
+    program, libraries = populate(spec.prefix, spec.name, spec.version)
+
+    with fixed_environment():
+        # The first call fills the memoized layouts of the packages
+        start = time.time()
+        env = run_environment(pkg)
+        cold = time.time() - start
+
+        timings = []
+        for _ in range(repeat):
+            start = time.time()
+            run_environment(pkg)
+            timings.append(time.time() - start)
+        timings.sort()
+
+    variables = applied(env)
+    path = _entries(variables['PATH'])
+    ld_library_path = _entries(variables['LD_LIBRARY_PATH'])
+    return {
+        'spec': spec.short_spec,
+        'cold_ms': cold * 1000,
+        'best_ms': timings[0] * 1000,
+        'median_ms': timings[len(timings) // 2] * 1000,
+        'modifications': len(list(env)),
+        'path_entries': len(path),
+        'path_length': len(variables['PATH']),
+        'ld_library_path_entries': len(ld_library_path),
+        'ld_library_path_length': len(variables['LD_LIBRARY_PATH']),
+        'main_program': program,
+        'exec_lookups': program and exec_lookups(variables['PATH'], program),
+        # A library not in the cache is looked up in every entry in turn,
+        # until the one holding it
+        'library_lookups': [
+            library_lookups(variables['LD_LIBRARY_PATH'], library)
+            for library in libraries],
+    }
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description='Times the run environments of the packages')
+    parser.add_argument('--repeat', type=int, default=20,
+                        help='number of timed calls per package')
+    parser.add_argument('--output', help='JSON file to write, or stdout')
+    parser.add_argument('--all-versions', action='store_true',
+                        help='run every version of the packages')
+    parser.add_argument('packages', nargs='*',
+                        help='packages to run, all of them by default')
+    args = parser.parse_args(argv)
+
+    repo = spack.repo.path.get_repo(namespace)
+    # Base classes such as binary-payload have no version to install
+    names = args.packages or sorted(
+        name for name in repo.all_package_names()
+        if repo.get_pkg_class(name).versions)
+    if args.all_versions:
+        names = ['{0}@{1}'.format(name, version) for name in names
+                 for version in sorted(repo.get_pkg_class(name).versions)]
+
+    tmpdir = tempfile.mkdtemp()
+    results = {}
+    try:
+        for name in names:
+            try:
+                results[name] = benchmark(name, tmpdir, args.repeat)
+            except Exception as e:
+                results[name] = {
+                    'error': '{0}: {1}'.format(type(e).__name__, e)}
+    finally:
+        shutil.rmtree(tmpdir)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    else:
+        json.dump(results, sys.stdout, indent=2, sort_keys=True)
+        print()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
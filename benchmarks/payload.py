@@ -0,0 +1,150 @@
+##############################################################################
+# Benchmark of the helpers installing large binary payloads.
+#
+# Run it with the repository registered in Spack:
+#
+#     spack python benchmarks/payload.py [--files N] [--large N]
+#                                        [--large-size MB] [--jobs N,...]
+#                                        [--dir DIR] [--output FILE]
+#
+# A synthetic tree of many small files and a few large ones is generated in
+# DIR, by default a temporary directory, and copied with each number of
+# jobs. Its manifest is then recorded and verified with and without the
+# checksums, as by bin/payload_manifest.py. Put DIR on the filesystem to
+# measure, e.g. the parallel one the packages are installed to. The results
+# are written as JSON.
+##############################################################################
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+from spack.pkg.scitasexternal.binary_payload import (copy_tree_parallel,
+                                                     verify_manifest,
+                                                     write_manifest)
+
+
+def make_tree(root, files, large, large_size):
+    """Writes files small files, spread over a few levels of directories,
+    and large files of large_size bytes. Returns the total size."""
+    rng = random.Random(0)
+    total = 0
+    for index in range(files):
+        directory = os.path.join(root, 'd{0}'.format(index % 16),
+                                 'e{0}'.format(index % 64))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        size = rng.choice((512, 4096, 16384, 65536))
+        with open(os.path.join(directory, 'f{0}'.format(index)), 'wb') as f:
+            f.write(os.urandom(size))
+        total += size
+
+    block = os.urandom(1 << 20)
+    for index in range(large):
+        with open(os.path.join(root, 'large{0}'.format(index)), 'wb') as f:
+            for _ in range(large_size >> 20):
+                f.write(block)
+        total += large_size
+    return total
+
+
+def timed(function, *args, **kwargs):
+    start = time.time()
+    function(*args, **kwargs)
+    return max(time.time() - start, 1e-6)
+
+
+def benchmark_copy(src, workdir, jobs, files, size):
+    """Times a full copy with a manifest, then the same copy again, which
+    is the resume of an interrupted install."""
+    dest = os.path.join(workdir, 'copy-{0}'.format(jobs))
+    manifest = os.path.join(workdir, 'manifest-{0}'.format(jobs))
+    try:
+        full = timed(copy_tree_parallel, src, dest, jobs=jobs,
+                     manifest=manifest)
+        resume = timed(copy_tree_parallel, src, dest, jobs=jobs,
+                       manifest=manifest)
+    finally:
+        shutil.rmtree(dest, ignore_errors=True)
+        if os.path.exists(manifest):
+            os.remove(manifest)
+    return {
+        'copy_s': full,
+        'copy_mb_per_s': size / full / 1e6,
+        'copy_files_per_s': files / full,
+        'resume_s': resume,
+        'resume_files_per_s': files / resume,
+    }
+
+
+def benchmark_manifest(src, workdir, jobs, files):
+    """Times the recording of a manifest of src, then its verification by
+    sizes and mtimes only and with the checksums."""
+    manifest = os.path.join(workdir, 'manifest-{0}'.format(jobs))
+    try:
+        record = timed(write_manifest, src, manifest, jobs=jobs)
+        quick = timed(verify_manifest, manifest, root=src, jobs=jobs,
+                      check_hashes=False)
+        full = timed(verify_manifest, manifest, root=src, jobs=jobs)
+    finally:
+        if os.path.exists(manifest):
+            os.remove(manifest)
+    return {
+        'record_s': record,
+        'record_files_per_s': files / record,
+        'verify_quick_s': quick,
+        'verify_quick_files_per_s': files / quick,
+        'verify_s': full,
+        'verify_files_per_s': files / full,
+    }
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description='Times the copy and the manifest of a synthetic payload')
+    parser.add_argument('--files', type=int, default=5000,
+                        help='number of small files')
+    parser.add_argument('--large', type=int, default=8,
+                        help='number of large files')
+    parser.add_argument('--large-size', type=int, default=64,
+                        help='size of the large files in MB')
+    parser.add_argument('--jobs', default='1,8,32',
+                        help='comma-separated numbers of jobs to run with')
+    parser.add_argument('--dir', help='directory to work in')
+    parser.add_argument('--output', help='JSON file to write, or stdout')
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(dir=args.dir)
+    try:
+        src = os.path.join(workdir, 'payload')
+        size = make_tree(src, args.files, args.large, args.large_size << 20)
+        files = args.files + args.large
+        results = {
+            'files': files,
+            'bytes': size,
+            'copy': dict(
+                (jobs, benchmark_copy(src, workdir, int(jobs), files, size))
+                for jobs in args.jobs.split(',')),
+            'manifest': dict(
+                (jobs, benchmark_manifest(src, workdir, int(jobs), files))
+                for jobs in args.jobs.split(',')),
+        }
+    finally:
+        shutil.rmtree(workdir)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    else:
+        json.dump(results, sys.stdout, indent=2, sort_keys=True)
+        print()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,79 @@
+##############################################################################
+# Records or verifies the payload manifest of installed packages.
+#
+# The payload of the licensed packages deriving from BinaryPayload is put in
+# place out of Spack, after "spack install" or as an external. Record its
+# manifest once it is complete, which also installs the wrappers and
+# settings of the package into it, then verify it at any time:
+#
+#     spack python bin/payload_manifest.py record [--jobs N] spec ...
+#     spack python bin/payload_manifest.py verify [--jobs N] [--quick] spec
+#
+# verify exits with status 1 when a file is missing or changed. --quick only
+# compares the sizes and mtimes, not the checksums.
+##############################################################################
+from __future__ import print_function
+
+import argparse
+import os
+import sys
+
+import llnl.util.tty as tty
+import spack.cmd
+import spack.store
+
+
+def installed_package(spec):
+    """Returns the package of the single installed spec matching spec."""
+    matches = spack.store.db.query(spec, installed=True)
+    if len(matches) != 1:
+        tty.die('{0} matches {1} installed specs, expected one'.format(
+            spec, len(matches)))
+    pkg = matches[0].package
+    if not hasattr(pkg, 'record_manifest'):
+        tty.die('{0} has no payload manifest'.format(matches[0].name))
+    return pkg
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description='Records or verifies payload manifests')
+    parser.add_argument('action', choices=('record', 'verify'))
+    parser.add_argument('--jobs', type=int, default=8,
+                        help='number of files read in parallel')
+    parser.add_argument('--quick', action='store_true',
+                        help='only compare sizes and mtimes when verifying')
+    parser.add_argument('specs', nargs='+', help='installed specs')
+    args = parser.parse_args(argv)
+
+    failed = False
+    for spec in spack.cmd.parse_specs(args.specs):
+        pkg = installed_package(spec)
+        if args.action == 'record':
+            pkg.install_scripts()
+            pkg.record_manifest(jobs=args.jobs)
+            tty.msg('Recorded {0}'.format(pkg.payload_manifest))
+            continue
+
+        if not os.path.exists(pkg.payload_manifest):
+            failed = True
+            tty.error('{0}: no manifest recorded in {1}'.format(
+                pkg.spec.short_spec, pkg.payload_manifest))
+            continue
+
+        problems = pkg.verify_payload(jobs=args.jobs,
+                                      check_hashes=not args.quick)
+        for path, problem in sorted(problems):
+            print('{0}: {1}'.format(path, problem))
+        if problems:
+            failed = True
+            tty.error('{0}: {1} files do not match {2}'.format(
+                pkg.spec.short_spec, len(problems), pkg.payload_manifest))
+        else:
+            tty.msg('{0}: payload matches {1}'.format(
+                pkg.spec.short_spec, pkg.payload_manifest))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -1,8 +1,60 @@
 from spack import *
+from spack.pkg.scitasexternal.binary_payload import (SLURM_FUNCTIONS,
+                                                     BinaryPayload)
 
+import os
 import spack.environment
 
-class Abaqus(Package):
+# Settings appended to the site abaqus_v6.env, evaluated by Abaqus when a
+# job is submitted. Within a Slurm job they run the analysis with MPI on
+# the tasks of the job, with the scratch on the local disk of the nodes.
+_site_settings_begin = '# BEGIN Slurm settings, generated by Spack'
+_site_settings_end = '# END Slurm settings'
+_site_settings = """
+import os as _os
+import subprocess as _subprocess
+
+if 'SLURM_JOB_NODELIST' in _os.environ:
+    mp_mode = MPI
+    # Every CPU of every task runs an analysis process
+    _cpus_per_task = int(_os.environ.get('SLURM_CPUS_PER_TASK', 1))
+    cpus = int(_os.environ.get('SLURM_NTASKS', 1)) * _cpus_per_task
+
+    _hosts = list(map(str.split, _subprocess.Popen(
+        ['bash', '-c', {slurm_functions!r} + 'slurm_hosts " "'],
+        stdout=_subprocess.PIPE,
+        universal_newlines=True).communicate()[0].splitlines()))
+    if _hosts and all(len(_host) == 2 for _host in _hosts):
+        mp_host_list = [[_host, int(_tasks) * _cpus_per_task]
+                        for _host, _tasks in _hosts]
+
+    for _variable in {scratch_variables!r}:
+        if _os.environ.get(_variable):
+            scratch = _os.environ[_variable]
+            break
+
+    _memory = int(_os.environ.get('SLURM_MEM_PER_NODE', 0))
+    if not _memory:
+        _memory = int(_os.environ.get('SLURM_MEM_PER_CPU', 0)) * \\
+            int(_os.environ.get('SLURM_CPUS_ON_NODE', 0))
+    if _memory:
+        memory = '%d mb' % int(_memory * {memory_fraction})
+
+    del _cpus_per_task, _hosts, _variable, _memory
+del _os, _subprocess
+"""
+
+
+def site_settings(memory_fraction, scratch_variables):
+    """Returns the Slurm settings of the site environment file, giving the
+    analysis memory_fraction of the memory of the job and the scratch in
+    the first of scratch_variables that is set."""
+    return _site_settings.format(slurm_functions=SLURM_FUNCTIONS,
+                                 memory_fraction=memory_fraction,
+                                 scratch_variables=tuple(scratch_variables))
+
+
+class Abaqus(BinaryPayload):
     """
     Abaqus at the EPFL is provided by the STI - http://sti.epfl.ch/it/page-37949-fr.html
     """
@@ -15,10 +67,43 @@ class Abaqus(Package):
 
     version('6.14-1')
 
+    # Fraction of the memory of the job given to the analysis
+    memory_fraction = 0.9
+
+    # Variables holding node-local scratch, in order of preference
+    scratch_variables = ['SLURM_TMPDIR', 'TMPDIR']
+
+    @property
+    def site_env(self):
+        return join_path(self.prefix, 'SMA', 'site', 'abaqus_v6.env')
+
     def install(self, spec, prefix):
         pass
 
+    def install_scripts(self):
+        """Adds the Slurm settings to the site environment file, replacing
+        the ones added before. The file shipped with the payload replaces
+        the one written at install time, the settings are merged into it
+        when the manifest is recorded."""
+        lines = []
+        if os.path.exists(self.site_env):
+            with open(self.site_env) as f:
+                lines = f.read().splitlines()
+        if _site_settings_begin in lines and _site_settings_end in lines:
+            begin = lines.index(_site_settings_begin)
+            end = lines.index(_site_settings_end)
+            del lines[begin:end + 1]
+
+        mkdirp(os.path.dirname(self.site_env))
+        with open(self.site_env, 'w') as f:
+            for line in lines:
+                f.write(line + '\n')
+            f.write(_site_settings_begin)
+            f.write(site_settings(self.memory_fraction,
+                                  self.scratch_variables))
+            f.write(_site_settings_end + '\n')
+
 
     def setup_environment(self, spack_env, run_env):
 
-        run_env.prepend_path('PATH', '/ssoft/spack/external/abaqus/6.14-1/code/bin')
+        run_env.prepend_path('PATH', join_path(self.prefix, 'code', 'bin'))
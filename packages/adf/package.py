@@ -24,8 +24,9 @@
 ##############################################################################
 
 from spack import *
+from spack.pkg.scitasexternal.binary_payload import BinaryPayload
 
-class Adf(Package):
+class Adf(BinaryPayload):
     """ADF is a DFT software for modelling chemistry."""
 
     homepage = "http://www.scm.com"
@@ -35,11 +36,13 @@ class Adf(Package):
 
     version('2017.111')
 
+    payload_root = '/ssoft/spack/external/adf/adf2017.111'
+
     def install(self, spec, prefix):
         pass
 
     def setup_environment(self, spack_env, run_env):
-        adf_base = '/ssoft/spack/external/adf/adf2017.111'
+        adf_base = self.payload_root
         
         run_env.set('ADFBIN', join_path(adf_base, 'bin'))
         run_env.set('ADFHOME', adf_base)
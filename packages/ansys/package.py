@@ -38,9 +38,128 @@
 # please first remove this boilerplate and all FIXME comments.
 #
 from spack import *
+from llnl.util.lang import memoized
+from spack.pkg.scitasexternal.binary_payload import (SLURM_FUNCTIONS,
+                                                     BinaryPayload,
+                                                     existing_paths,
+                                                     write_script)
 
+import os
 
-class Ansys(Package):
+# Releases from 2020 on are named after the year, while the installed
+# tree still uses the dotted release number.
+_version_mapping = {'2020R2': '20.2',
+                    '2022R1': '22.1',
+                    '2022R2': '22.2'}
+
+# Run-time layout of an Ansys installation, in the order the entries end up
+# in the variable. The last column restricts an entry to a version range.
+_run_paths = [
+    ('PATH', 'icemcfd/linux64_amd/bin', None),
+    ('PATH', 'Framework/bin/Linux64', None),
+    ('PATH', 'tgrid/bin', '17.1'),
+    ('PATH', 'RSM/Config/tools/linux', None),
+    ('PATH', 'polyflow/bin', None),
+    ('PATH', 'fluent/bin', None),
+    ('PATH', 'autodyn/bin', None),
+    ('PATH', 'TurboGrid/bin', None),
+    ('PATH', 'Icepak/bin', None),
+    ('PATH', 'CFX/bin', None),
+    ('PATH', 'CFD-Post/bin', None),
+    ('PATH', 'ansys/bin', None),
+    ('LD_LIBRARY_PATH', 'Framework/bin/Linux64/Mesa', ':20.1'),
+    ('LD_LIBRARY_PATH', 'polyflow/polyflow{version}.0/lnamd64/libs', ':20.1'),
+    ('LD_LIBRARY_PATH', 'Framework/bin/Linux64', ':20.1'),
+]
+
+
+def dotted_version(version):
+    """Returns the dotted release number of an Ansys version."""
+    version = str(version)
+    return Version(_version_mapping.get(version, version)).up_to(2)
+
+
+@memoized
+def _run_layout(version, prefix):
+    """Resolves the run-time layout for a version and an install prefix.
+
+    Returns a tuple of (variable, value) pairs, with all the directories of
+    a variable already joined so that they can be prepended at once.
+    Directories missing from an existing prefix are left out.
+    """
+    dotted = dotted_version(version)
+    layout = []
+    for variable, path, when in _run_paths:
+        if when is not None and not dotted.satisfies(ver(when)):
+            continue
+        path = join_path(prefix, path.format(version=dotted.dotted))
+        for name, paths in layout:
+            if name == variable:
+                paths.append(path)
+                break
+        else:
+            layout.append((variable, [path]))
+
+    resolved = []
+    for name, paths in layout:
+        paths = existing_paths(prefix, tuple(paths))
+        if paths:
+            resolved.append((name, os.pathsep.join(paths)))
+    return tuple(resolved)
+
+
+# Wrappers running the solvers on the processes of the Slurm job, over the
+# fastest interconnect of the node and with the processes pinned
+_slurm_launcher = """#!/bin/bash
+{slurm_functions}
+if [ -z "$SLURM_JOB_NODELIST" ]; then
+    echo "$(basename "$0"): must be run in a Slurm job" >&2
+    exit 1
+fi
+
+if [ -n "$(ls -A /sys/class/infiniband 2>/dev/null)" ]; then
+    INTERCONNECT=infiniband
+else
+    INTERCONNECT=ethernet
+fi
+
+# One core per process, or the CPUs of the task for hybrid runs
+export I_MPI_PIN=1
+export I_MPI_PIN_DOMAIN=${{SLURM_CPUS_PER_TASK:-core}}
+
+{command}"""
+
+_fluent_command = """HOSTFILE=$(mktemp "${{TMPDIR:-/tmp}}/fluent-hosts.XXXXXX")
+trap 'rm -f "$HOSTFILE"' EXIT
+slurm_hosts : > "$HOSTFILE"
+
+"{program}" "$@" -g -t"$SLURM_NTASKS" -cnf="$HOSTFILE" \\
+    -p"$INTERCONNECT" -mpi=intel
+"""
+
+_cfx_command = """exec "{program}" "$@" \\
+    -par-dist "$(slurm_hosts '*' | paste -s -d,)" \\
+    -start-method "Intel MPI Distributed Parallel"
+"""
+
+
+def write_launchers(bin_dir, prefix):
+    """Writes fluent-slurm and cfx5solve-slurm to bin_dir, running the
+    solvers of the installation in prefix. Every version runs on the Intel
+    MPI it ships, which outperforms the default IBM (Platform) MPI on our
+    InfiniBand nodes."""
+    commands = {
+        'fluent-slurm': _fluent_command.format(
+            program=join_path(prefix, 'fluent', 'bin', 'fluent')),
+        'cfx5solve-slurm': _cfx_command.format(
+            program=join_path(prefix, 'CFX', 'bin', 'cfx5solve')),
+    }
+    for name, command in commands.items():
+        write_script(join_path(bin_dir, name), _slurm_launcher.format(
+            slurm_functions=SLURM_FUNCTIONS, command=command))
+
+
+class Ansys(BinaryPayload):
     """
     Ansys Fluent - To use this software you need to be a member of the
     ansys-users group Please see http://ansys.epfl.ch for further information
@@ -57,53 +176,20 @@ class Ansys(Package):
     version('19.2')
     version('17.1')
 
+    @property
+    def run_layout(self):
+        return _run_layout(str(self.spec.version), str(self.prefix))
+
     def install(self, spec, prefix):
         pass
 
+    def install_scripts(self):
+        """Installs fluent-slurm and cfx5solve-slurm in prefix/bin."""
+        mkdirp(self.prefix.bin)
+        write_launchers(self.prefix.bin, str(self.prefix))
+
     def setup_environment(self, spack_env, run_env):
-        version_mapping = { '2020R2': '20.2',
-                            '2022R1': '22.1',
-                            '2022R2': '22.2'}
-        version = self.spec.version
-
-        if str(version) in version_mapping:
-           version = Version(version_mapping[str(version)])
-        version_dotted = version.up_to(2).dotted
-
-        ansys_prefix = self.prefix
-
-        run_env.prepend_path('PATH', join_path(ansys_prefix, 'ansys/bin'))
-        run_env.prepend_path('PATH', join_path(ansys_prefix, 'CFD-Post/bin'))
-        run_env.prepend_path('PATH', join_path(ansys_prefix, 'CFX/bin'))
-        run_env.prepend_path('PATH', join_path(ansys_prefix, 'Icepak/bin'))
-        run_env.prepend_path('PATH', join_path(ansys_prefix, 'TurboGrid/bin'))
-        run_env.prepend_path('PATH', join_path(ansys_prefix, 'autodyn/bin'))
-        run_env.prepend_path('PATH', join_path(ansys_prefix, 'fluent/bin'))
-        run_env.prepend_path('PATH', join_path(ansys_prefix, 'polyflow/bin'))
-
-        run_env.prepend_path(
-            'PATH',
-            join_path(ansys_prefix, 'RSM/Config/tools/linux'))
-
-        if version == Version('17.1'):
-            run_env.prepend_path('PATH', join_path(ansys_prefix, 'tgrid/bin'))
-
-        run_env.prepend_path(
-            'PATH',
-            join_path(ansys_prefix, 'Framework/bin/Linux64'))
-        run_env.prepend_path(
-            'PATH',
-            join_path(ansys_prefix, 'icemcfd/linux64_amd/bin'))
-
-        if version < Version('20.2'):
-            run_env.prepend_path(
-                'LD_LIBRARY_PATH',
-                join_path(ansys_prefix, 'Framework/bin/Linux64'))
-            run_env.prepend_path(
-                'LD_LIBRARY_PATH',
-                join_path(
-                    ansys_prefix,
-                    'polyflow/polyflow{0}.0/lnamd64/libs'.format(version.up_to(2).dotted))) # noqa: E501
-            run_env.prepend_path(
-                'LD_LIBRARY_PATH',
-                join_path(ansys_prefix, 'Framework/bin/Linux64/Mesa'))
+        for variable, paths in self.run_layout:
+            run_env.prepend_path(variable, paths)
+        for bin_dir in existing_paths(str(self.prefix), (self.prefix.bin,)):
+            run_env.prepend_path('PATH', bin_dir)
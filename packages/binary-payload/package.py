@@ -0,0 +1,508 @@
+# Copyright 2013-2019 Lawrence Livermore National Security, LLC and other
+# Spack Project Developers. See the top-level COPYRIGHT file for details.
+#
+# SPDX-License-Identifier: (Apache-2.0 OR MIT)
+
+from spack import *
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from llnl.util.lang import memoized
+
+import fcntl
+import hashlib
+import llnl.util.tty as tty
+import os
+import shutil
+import time
+
+
+@memoized
+def existing_paths(prefix, paths):
+    """Returns the paths that exist, as long as the prefix itself exists.
+
+    Every entry of PATH or LD_LIBRARY_PATH costs a lookup on each exec or
+    dlopen, so the run paths missing from an installed prefix are left
+    out. All of them are kept when the prefix cannot be reached from where
+    this runs, e.g. when generating modules for another cluster.
+    """
+    if not os.path.isdir(prefix):
+        return paths
+    existing = tuple(path for path in paths if os.path.isdir(path))
+    for path in paths:
+        if path not in existing:
+            tty.debug('Pruning missing run path {0}'.format(path))
+    return existing
+
+
+def write_script(path, content):
+    """Writes an executable script to path.
+
+    A file or a link already there is removed first, so that a link left
+    by the installation of the payload, e.g. to the program the script
+    wraps, is replaced rather than written through.
+    """
+    if os.path.lexists(path):
+        os.remove(path)
+    with open(path, 'w') as f:
+        f.write(content)
+    os.chmod(path, 0o755)
+
+
+def scratch_chain(variables, default=''):
+    """Returns a quoted shell expansion to the value of the first of
+    variables that is set and not empty, or to default."""
+    chain = default
+    for variable in reversed(variables):
+        chain = '${{{0}:-{1}}}'.format(variable, chain)
+    return '"{0}"'.format(chain)
+
+
+# Shell functions describing the layout of the Slurm job a script runs in,
+# for the bash scripts of the packages. SLURM_TASKS_PER_NODE is e.g.
+# 4(x2),3 for four tasks on each of the first two nodes and three on the
+# last one, in the order of the node list.
+SLURM_FUNCTIONS = """# Prints the number of tasks of each node of the job
+slurm_tasks_per_node() {
+    local group count repeat
+    for group in ${SLURM_TASKS_PER_NODE//,/ }; do
+        count=${group%%(*}
+        repeat=1
+        if [ "$group" != "$count" ]; then
+            repeat=${group#*(x}
+            repeat=${repeat%)}
+        fi
+        for (( ; repeat > 0; repeat-- )); do
+            echo "$count"
+        done
+    done
+}
+
+# Prints the host and the number of tasks of each node of the job,
+# separated by $1
+slurm_hosts() {
+    paste -d "$1" <(scontrol show hostnames "$SLURM_JOB_NODELIST") \\
+        <(slurm_tasks_per_node)
+}
+"""
+
+
+# Directory of the prefix holding the library index, see link_library_index
+LIBRARY_INDEX = '.libindex'
+
+
+def link_library_index(prefix, lib_dirs):
+    """Links the shared libraries found in lib_dirs into a single directory.
+
+    With the index as the only LD_LIBRARY_PATH entry, the dynamic loader
+    resolves every library with a single lookup instead of searching each
+    directory of the chain in turn. Libraries found in earlier directories
+    take precedence, as they would in LD_LIBRARY_PATH.
+
+    Returns the path of the index, or None if no library was found.
+    """
+    index = join_path(prefix, LIBRARY_INDEX)
+    linked = 0
+    for lib_dir in lib_dirs:
+        if not os.path.isdir(lib_dir):
+            continue
+        for entry in os.scandir(lib_dir):
+            if '.so' not in entry.name or entry.is_dir():
+                continue
+            link = join_path(index, entry.name)
+            if os.path.lexists(link):
+                continue
+            mkdirp(index)
+            os.symlink(entry.path, link)
+            linked += 1
+
+    tty.debug('{0}: indexed {1} libraries'.format(index, linked))
+    return index if linked else None
+
+
+# ioctl cloning a file on filesystems supporting reflinks (btrfs, xfs, ...)
+_FICLONE = 0x40049409
+
+
+def _copy_data(src, dest, size):
+    """Copies the content of the file src to dest, preferably in the kernel.
+
+    Reflinks are tried first, then copy_file_range, and finally a plain
+    buffered copy if the filesystems support neither.
+    """
+    try:
+        fcntl.ioctl(dest.fileno(), _FICLONE, src.fileno())
+        return
+    except OSError:
+        pass
+
+    if hasattr(os, 'copy_file_range'):
+        try:
+            copied = 0
+            while copied < size:
+                count = os.copy_file_range(src.fileno(), dest.fileno(),
+                                           size - copied)
+                if not count:
+                    break
+                copied += count
+            return
+        except OSError:
+            src.seek(0)
+            dest.seek(0)
+            dest.truncate()
+
+    shutil.copyfileobj(src, dest, 1 << 20)
+
+
+def _hash_file(path):
+    """Returns the sha256 of a file, read in fixed-size blocks."""
+    checksum = hashlib.sha256()
+    with open(path, 'rb') as stream:
+        for block in iter(lambda: stream.read(1 << 20), b''):
+            checksum.update(block)
+    return checksum.hexdigest()
+
+
+def _stream_data(src, dest):
+    """Copies the content of the file src to dest and returns its sha256."""
+    checksum = hashlib.sha256()
+    for block in iter(lambda: src.read(1 << 20), b''):
+        checksum.update(block)
+        dest.write(block)
+    return checksum.hexdigest()
+
+
+def _copy_file(src, dest, stat, checksum=False, known=None):
+    """Copies a file unless dest already has the same size and mtime.
+
+    The data is written under a temporary name first, so that a file is
+    never seen complete when the copy was interrupted. With checksum, the
+    data goes through a sha256 while it is copied; for skipped files, the
+    known sha256 is used if given, otherwise the copy is read back.
+
+    Returns a tuple (dest, stat, bytes copied or None if the file was
+    skipped, sha256 or None without checksum).
+    """
+    try:
+        dest_stat = os.stat(dest)
+        if (dest_stat.st_size == stat.st_size and
+                dest_stat.st_mtime_ns == stat.st_mtime_ns):
+            if checksum and known is None:
+                known = _hash_file(dest)
+            return dest, stat, None, known
+    except OSError:
+        pass
+
+    digest = None
+    partial = dest + '.partial'
+    with open(src, 'rb') as fsrc:
+        with open(partial, 'wb') as fdest:
+            if checksum:
+                digest = _stream_data(fsrc, fdest)
+            else:
+                _copy_data(fsrc, fdest, stat.st_size)
+    shutil.copystat(src, partial)
+    os.rename(partial, dest)
+    return dest, stat, stat.st_size, digest
+
+
+# Name of the manifest of the files installed in a prefix
+PAYLOAD_MANIFEST = '.payload_manifest'
+
+
+def read_manifest(path):
+    """Yields the (path, size, mtime_ns, sha256) entries of a manifest.
+
+    Paths are relative to the root of the tree the manifest describes, by
+    default the directory holding the manifest.
+    """
+    with open(path) as manifest:
+        for line in manifest:
+            sha256, size, mtime, name = line.rstrip('\n').split('\t', 3)
+            yield name, int(size), int(mtime), sha256
+
+
+def _walk_files(src, dest, directories):
+    """Yields the (source, destination, stat) of the regular files of src.
+
+    Directories and symbolic links are created in dest along the way, and
+    the (source, destination) of each directory is appended to directories
+    once its content has been walked, deepest first.
+    """
+    mkdirp(dest)
+    for entry in os.scandir(src):
+        target = join_path(dest, entry.name)
+        if entry.is_symlink():
+            link = os.readlink(entry.path)
+            if os.path.lexists(target):
+                if os.path.islink(target) and os.readlink(target) == link:
+                    continue
+                os.remove(target)
+            os.symlink(link, target)
+        elif entry.is_dir():
+            for item in _walk_files(entry.path, target, directories):
+                yield item
+        else:
+            yield entry.path, target, entry.stat()
+    directories.append((src, dest))
+
+
+def _remove_stale_partials(src, dest):
+    """Removes the partial copies left in dest by an interrupted copy of
+    files that are no longer in src. The others are overwritten when their
+    file is copied again."""
+    if not os.path.isdir(dest):
+        return
+    for entry in os.scandir(dest):
+        source = join_path(src, entry.name)
+        if entry.is_dir(follow_symlinks=False):
+            _remove_stale_partials(source, entry.path)
+        elif (entry.name.endswith('.partial') and
+                not os.path.lexists(source[:-len('.partial')])):
+            tty.debug('Removing stale partial copy {0}'.format(entry.path))
+            os.remove(entry.path)
+
+
+def _bounded_map(executor, function, arguments, window):
+    """Yields the results of function over arguments run by executor.
+
+    At most window calls are queued at a time, so that the arguments are
+    consumed lazily. Results are yielded in completion order.
+    """
+    pending = set()
+    for args in arguments:
+        if len(pending) >= window:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+        pending.add(executor.submit(function, *args))
+
+    for future in wait(pending)[0]:
+        yield future.result()
+
+
+def copy_tree_parallel(src, dest, jobs=8, manifest=None):
+    """Copies the tree src into dest with a pool of jobs threads.
+
+    Permissions and times of files and directories are preserved, and
+    files already in dest with the same size and mtime are skipped, so an
+    interrupted copy is resumed by running it again. Only a bounded number of copies is queued at a
+    time and files are streamed in fixed-size blocks.
+
+    With manifest, the sha256 of every file is computed while it is copied
+    and a manifest of (path, size, mtime, sha256) is written to that path,
+    with paths relative to its directory. The checksums of skipped files
+    are taken from the previous manifest when it is still accurate, so a
+    reinstall does not read them again.
+    """
+    root = os.path.dirname(manifest) if manifest else dest
+    known = {}
+    if manifest and os.path.exists(manifest):
+        known = dict((name, (size, mtime, sha256))
+                     for name, size, mtime, sha256 in read_manifest(manifest))
+
+    _remove_stale_partials(src, dest)
+    directories = []
+
+    def arguments():
+        for src_file, dest_file, stat in _walk_files(src, dest, directories):
+            previous = known.pop(os.path.relpath(dest_file, root), None)
+            digest = None
+            if previous and previous[:2] == (stat.st_size, stat.st_mtime_ns):
+                digest = previous[2]
+            yield src_file, dest_file, stat, bool(manifest), digest
+
+    start = time.time()
+    copied = skipped = copied_bytes = 0
+    entries = open(manifest + '.partial', 'w') if manifest else None
+    try:
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            for dest_file, stat, size, digest in _bounded_map(
+                    executor, _copy_file, arguments(), 4 * jobs):
+                if size is None:
+                    skipped += 1
+                else:
+                    copied += 1
+                    copied_bytes += size
+                if entries:
+                    entries.write('{0}\t{1}\t{2}\t{3}\n'.format(
+                        digest, stat.st_size, stat.st_mtime_ns,
+                        os.path.relpath(dest_file, root)))
+    finally:
+        if entries:
+            entries.close()
+    # Once their files are in, so that restricted directories stay writable
+    # while copying and keep their mtime
+    for src_dir, dest_dir in directories:
+        shutil.copystat(src_dir, dest_dir)
+    if manifest:
+        os.rename(manifest + '.partial', manifest)
+
+    elapsed = max(time.time() - start, 1e-6)
+    tty.msg('Copied {0} files to {1} ({2:.1f} MB/s, {3:.0f} files/s), '
+            'skipped {4} unchanged files'.format(
+                copied, dest, copied_bytes / elapsed / 1e6, copied / elapsed,
+                skipped))
+
+
+# Size of the blocks hashed at the start, middle and end of large files
+_SAMPLE_BLOCK = 1 << 16
+
+
+def _sampled_digest(path, size):
+    """Returns the sha256 of a few blocks of a file, or of all of it if it
+    is small enough. Sampled checksums are prefixed with 'sampled:'."""
+    if size <= 3 * _SAMPLE_BLOCK:
+        return _hash_file(path)
+
+    checksum = hashlib.sha256()
+    with open(path, 'rb') as stream:
+        for offset in (0, size // 2, size - _SAMPLE_BLOCK):
+            stream.seek(offset)
+            checksum.update(stream.read(_SAMPLE_BLOCK))
+    return 'sampled:' + checksum.hexdigest()
+
+
+def _walk_payload(root, top=True):
+    """Yields the paths of the regular files of a prefix.
+
+    The Spack metadata and the files generated by this module at the top
+    of the prefix are not part of the payload.
+    """
+    for entry in os.scandir(root):
+        if top and (entry.name in ('.spack', LIBRARY_INDEX) or
+                    entry.name.startswith(PAYLOAD_MANIFEST)):
+            continue
+        if entry.is_symlink():
+            continue
+        if entry.is_dir():
+            for path in _walk_payload(entry.path, top=False):
+                yield path
+        else:
+            yield (entry.path,)
+
+
+def _record_file(path):
+    stat = os.stat(path)
+    return path, stat, _sampled_digest(path, stat.st_size)
+
+
+def write_manifest(root, manifest, jobs=8):
+    """Writes a manifest of the payload found in root.
+
+    Every file is recorded with its size, mtime and a sampled sha256, so
+    that the manifest of a multi-hundred-GB tree is computed in about the
+    time it takes to stat it.
+    """
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        with open(manifest + '.partial', 'w') as entries:
+            for path, stat, digest in _bounded_map(
+                    executor, _record_file, _walk_payload(root), 4 * jobs):
+                entries.write('{0}\t{1}\t{2}\t{3}\n'.format(
+                    digest, stat.st_size, stat.st_mtime_ns,
+                    os.path.relpath(path, root)))
+    os.rename(manifest + '.partial', manifest)
+
+
+def _check_file(path, size, mtime, digest, check_hashes):
+    """Returns why a file does not match its manifest entry, if it does not.
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return path, 'missing'
+
+    if stat.st_size != size:
+        return path, 'size changed'
+    if stat.st_mtime_ns != mtime:
+        return path, 'modified'
+    if check_hashes:
+        if digest.startswith('sampled:'):
+            actual = _sampled_digest(path, size)
+        else:
+            actual = _hash_file(path)
+        if actual != digest:
+            return path, 'content changed'
+    return None
+
+
+def verify_manifest(manifest, root=None, jobs=8, check_hashes=True):
+    """Checks the files of a tree against a manifest, with jobs threads.
+
+    Returns a list of (path, problem) for the files that are missing or
+    do not match their entry. Checksums are only compared when
+    check_hashes is set, otherwise only the sizes and mtimes are.
+    """
+    root = root or os.path.dirname(manifest)
+    arguments = ((join_path(root, name), size, mtime, digest, check_hashes)
+                 for name, size, mtime, digest in read_manifest(manifest))
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        return [problem for problem in _bounded_map(
+            executor, _check_file, arguments, 4 * jobs) if problem]
+
+
+def check_payload(manifest, root=None, jobs=8):
+    """Raises an InstallError listing the problems of a payload, if any."""
+    if not os.path.exists(manifest):
+        raise InstallError(
+            'No manifest of the payload in {0}, record it once the payload '
+            'is in place with: spack python bin/payload_manifest.py record '
+            '<spec>'.format(manifest))
+
+    problems = verify_manifest(manifest, root, jobs)
+    if problems:
+        raise InstallError('{0} files do not match {1}:\n{2}'.format(
+            len(problems), manifest, '\n'.join(
+                '    {0}: {1}'.format(path, problem)
+                for path, problem in sorted(problems))))
+
+
+class BinaryPayload(Package):
+    """Not installable, the base of the packages of this repository whose
+    payload is put in place out of Spack, either copied into the prefix by
+    hand or registered as an external.
+
+    Nothing of the payload exists when the install phases run, so its
+    manifest is recorded by an explicit step once it is in place:
+
+        spack python bin/payload_manifest.py record <spec>
+
+    and checked by "spack test run" or the verify command of the same
+    script. The scripts and settings the package adds to the payload are
+    written by install_scripts, both after the install and by the record
+    step, so that externals and payloads copied in later have them too. The helpers of this module are also imported by the packages
+    copying their payload themselves, e.g.
+
+        from spack.pkg.scitasexternal.binary_payload import copy_tree_parallel
+    """
+
+    @property
+    def payload_root(self):
+        """Directory holding the payload, the prefix unless overridden."""
+        return str(self.prefix)
+
+    @property
+    def payload_manifest(self):
+        return join_path(self.prefix, PAYLOAD_MANIFEST)
+
+    def install_scripts(self):
+        """Installs the wrappers and settings of the package into the
+        prefix. It may run again on a complete payload, so it replaces the
+        files it wrote before."""
+        pass
+
+    @run_after('install')
+    def _install_scripts(self):
+        self.install_scripts()
+
+    def record_manifest(self, jobs=8):
+        """Writes the manifest of the payload as it is now."""
+        write_manifest(self.payload_root, self.payload_manifest, jobs=jobs)
+
+    def verify_payload(self, jobs=8, check_hashes=True):
+        """Returns the (path, problem) of the payload files that do not match
+        the manifest."""
+        return verify_manifest(self.payload_manifest, root=self.payload_root,
+                               jobs=jobs, check_hashes=check_hashes)
+
+    def test(self):
+        check_payload(self.payload_manifest, root=self.payload_root)
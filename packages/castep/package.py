@@ -23,7 +23,10 @@
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
 ##############################################################################
 from spack import *
+from spack.pkg.scitasexternal.binary_payload import write_script
+from spack.util.environment import set_env
 import os
+import shutil
 
 
 class Castep(MakefilePackage):
@@ -38,26 +41,133 @@ class Castep(MakefilePackage):
 
     version('21.11', sha256='d909936a51dd3dff7a0847c2597175b05c8d0018d5afe416737499408914728f')
 
+    variant('fft', default='mkl', values=('fftw3', 'mkl'),
+            description='FFT library')
+    variant('mathlibs', default='mkl', values=('mkl', 'openblas'),
+            description='BLAS and LAPACK library')
+    variant('openmp', default=False, description='Enables OpenMP support')
+    variant('flavors', values=any_combination_of('avx2', 'avx512'),
+            description='Additional builds for these microarchitectures, '
+                        'chosen at run time by the CPU flags')
+
     depends_on('intel-mpi')
-    depends_on('intel-mkl')
-    depends_on('fftw-api@3')
+    depends_on('intel-mkl', when='fft=mkl')
+    depends_on('intel-mkl', when='mathlibs=mkl')
+    depends_on('intel-mkl threads=openmp', when='mathlibs=mkl +openmp')
+    depends_on('fftw-api@3', when='fft=fftw3')
+    depends_on('openblas', when='mathlibs=openblas')
+    depends_on('openblas threads=openmp', when='mathlibs=openblas +openmp')
+
+    # Compiler flags and /proc/cpuinfo flag of each flavor, best first
+    flavor_flags = [
+        ('avx512', {'gcc': '-march=skylake-avx512', 'intel': '-xCORE-AVX512'},
+         'avx512f'),
+        ('avx2', {'gcc': '-march=haswell', 'intel': '-xCORE-AVX2'}, 'avx2'),
+    ]
+
+    @property
+    def flavors(self):
+        selected = self.spec.variants['flavors'].value
+        return [f for f in self.flavor_flags if f[0] in selected]
+
+    def flavor_root(self, flavor):
+        return join_path(self.stage.path, 'build-{}'.format(flavor))
+
+    @property
+    def mklroot(self):
+        # The libraries are in $MKLROOT/lib/intel64
+        libs = self.spec['intel-mkl'].libs
+        return os.path.dirname(os.path.dirname(libs.directories[0]))
+
+    def make_args(self, root):
+        spec = self.spec
+        if spec.satisfies('fft=mkl'):
+            fft_dir = self.mklroot
+        else:
+            fft_dir = spec['fftw-api'].prefix.lib
+
+        if spec.satisfies('mathlibs=mkl'):
+            math_dir = self.mklroot
+        else:
+            math_dir = spec['openblas'].prefix.lib
+
+        if spec.satisfies('%gcc'):
+            arch = 'linux_x86_64_gfortran'
+        else:
+            arch = 'linux_x86_64_ifort'
+
+        return ['ROOTDIR={}'.format(root),
+                'FFT={}'.format(spec.variants['fft'].value),
+                'FFTLIBDIR={}'.format(fft_dir),
+                'MATHLIBS={}'.format(spec.variants['mathlibs'].value),
+                'MATHLIBDIR={}'.format(math_dir),
+                'ARCH={}'.format(arch),
+                'COMMS_ARCH=mpi',
+                'OPENMP={}'.format(1 if spec.satisfies('+openmp') else 0)]
 
     def setup_environment(self, spack_env, run_env):
-        run_env.prepend_path('PATH', self.prefix)
+        run_env.prepend_path('PATH', self.prefix.bin)
+
+    def edit(self, spec, prefix):
+        # Each flavor gets a pristine copy of the tree to build in
+        for name, _, _ in self.flavors:
+            shutil.copytree(self.build_directory, self.flavor_root(name),
+                            symlinks=True)
 
     def build(self, spec, prefix):
         with working_dir(self.build_directory):
-            make('ROOTDIR={}'.format(self.build_directory),
-                 'FFT=mkl',
-                 'FFTLIBDIR={}'.format(os.environ['MKLROOT']),
-                 'MATHLIBS=mkl',
-                 'MATHLIBDIR={}'.format(os.environ['MKLROOT']),
-                 'ARCH=linux_x86_64_ifort',
-                 'COMMS_ARCH=mpi'
-                 )
+            make(*self.make_args(self.build_directory))
+
+        # The flags are passed through the compiler wrappers, after the
+        # flags of the spec, so that they override the ones of the target
+        compiler = 'gcc' if spec.satisfies('%gcc') else 'intel'
+        for name, flags, _ in self.flavors:
+            fflags = ' '.join([os.environ.get('SPACK_FFLAGS', ''),
+                               flags[compiler]]).strip()
+            cflags = ' '.join([os.environ.get('SPACK_CFLAGS', ''),
+                               flags[compiler]]).strip()
+            with set_env(SPACK_FFLAGS=fflags, SPACK_CFLAGS=cflags):
+                with working_dir(self.flavor_root(name)):
+                    make(*self.make_args(self.flavor_root(name)))
 
     def install(self, spec, prefix):
+        # The same arguments as the build, so that nothing is rebuilt.
+        # make install copies into INSTALL_DIR without creating it.
+        mkdirp(self.install_dir('generic'))
         with working_dir(self.build_directory):
-            make('ROOTDIR={}'.format(self.build_directory),
-                 'INSTALL_DIR={}'.format(prefix),
-                 'install')
+            make(*(self.make_args(self.build_directory) +
+                   ['INSTALL_DIR={}'.format(self.install_dir('generic')),
+                    'install']))
+
+        for name, _, _ in self.flavors:
+            mkdirp(self.install_dir(name))
+            with working_dir(self.flavor_root(name)):
+                make(*(self.make_args(self.flavor_root(name)) +
+                       ['INSTALL_DIR={}'.format(self.install_dir(name)),
+                        'install']))
+
+        if self.flavors:
+            self.install_dispatcher()
+
+    def install_dir(self, flavor):
+        if not self.flavors:
+            return self.prefix.bin
+        return join_path(self.prefix.bin, flavor)
+
+    def install_dispatcher(self):
+        """Links every program in bin to a script running the flavor of
+        it that suits the CPU best."""
+        dispatcher = join_path(self.prefix.bin, 'castep-dispatch')
+        cases = ''.join('    *" {} "*) flavor={} ;;\n'.format(cpu_flag, name)
+                        for name, _, cpu_flag in self.flavors)
+        write_script(dispatcher, """#!/bin/sh
+flags=" $(grep -m 1 '^flags' /proc/cpuinfo | cut -d: -f2) "
+case "$flags" in
+{}    *) flavor=generic ;;
+esac
+exec "{}/$flavor/$(basename "$0")" "$@"
+""".format(cases, self.prefix.bin))
+
+        with working_dir(self.prefix.bin):
+            for program in os.listdir('generic'):
+                os.symlink('castep-dispatch', program)
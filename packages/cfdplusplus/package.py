@@ -24,9 +24,55 @@
 ##############################################################################
 #
 from spack import *
+from spack.pkg.scitasexternal.binary_payload import (SLURM_FUNCTIONS,
+                                                     BinaryPayload,
+                                                     existing_paths,
+                                                     write_script)
 
 
-class Cfdplusplus(Package):
+# Wrapper sizing the memory of the solver to the Slurm job it runs in, unless
+# the user set it. The wrapper runs on the first node of the job, whose
+# tasks share the memory of the job on the node, or all of the memory of
+# the node when the job does not limit it.
+_memory_wrapper = """#!/bin/bash
+{slurm_functions}
+if [ -n "$SLURM_JOB_ID" ]; then
+    MEMORY=${{SLURM_MEM_PER_NODE:-0}}
+    if [ "$MEMORY" -eq 0 ]; then
+        MEMORY=$(( ${{SLURM_MEM_PER_CPU:-0}} * ${{SLURM_CPUS_ON_NODE:-0}} ))
+    fi
+    if [ "$MEMORY" -eq 0 ]; then
+        MEMORY=$(( $(awk '/^MemTotal:/ {{print $2}}' "{meminfo}") / 1024 ))
+    fi
+    TASKS=${{SLURM_NTASKS_PER_NODE:-$(slurm_tasks_per_node | head -n 1)}}
+    if [ "${{TASKS:-0}}" -lt 1 ]; then
+        TASKS=1
+    fi
+
+    if [ "$MEMORY" -gt 0 ]; then
+        MAXIMUM=$(( MEMORY * {memory_percent} / 100 ))
+        export MCFD_MAXMEM=${{MCFD_MAXMEM:-${{MAXIMUM}}M}}
+        export MCFD_PROCMEM=${{MCFD_PROCMEM:-$(( MAXIMUM / TASKS ))M}}
+    fi
+fi
+
+exec "{program}" "$@"
+"""
+
+
+def write_memory_wrapper(path, program, memory_fraction,
+                         meminfo='/proc/meminfo'):
+    """Writes a wrapper of program to path, giving the solver
+    memory_fraction of the memory of the job, or of the MemTotal of
+    meminfo."""
+    write_script(path, _memory_wrapper.format(
+        slurm_functions=SLURM_FUNCTIONS,
+        meminfo=meminfo,
+        program=program,
+        memory_percent=int(round(memory_fraction * 100))))
+
+
+class Cfdplusplus(BinaryPayload):
     """Metacomp's Computational Fluid Dynamics (CFD) software suite."""
 
     homepage = "http://www.metacomptech.com/index.php/features/icfd"
@@ -38,36 +84,71 @@ class Cfdplusplus(Package):
     version('17.1')
     version('16.1')
 
+    variant('gui', default=True,
+            description='Set up the Tcl/Tk interface, not needed by batch '
+                        'jobs')
+    variant('par_lic_mode', default='2', values=('0', '1', '2'),
+            description='Parallel license mode of the solver '
+                        '(MCFD_PAR_LIC_MODE)')
+
+    # Fraction of the memory of the job given to the solver
+    memory_fraction = 0.9
+
+    # Wrapped so that they size their memory to the Slurm job
+    wrapped_programs = ['mcfd', 'mpimcfd']
+
+    @property
+    def mcfd_prefix(self):
+        version = str(self.spec.version.up_to(2).dotted)
+        return '{0}/mlib/mcfd.{1}'.format(self.prefix, version)
+
+    @property
+    def lib_dirs(self):
+        prefix = str(self.prefix)
+        return existing_paths(prefix, (prefix + '/glib', prefix + '/lib'))
+
     def install(self, spec, prefix):
         pass
 
+    def install_scripts(self):
+        """Installs the wrappers of the solvers in bin, first in PATH."""
+        mkdirp(self.prefix.bin)
+        for program in self.wrapped_programs:
+            write_memory_wrapper(
+                join_path(self.prefix.bin, program),
+                join_path(self.mcfd_prefix, 'exec', program),
+                self.memory_fraction)
+
     def setup_environment(self, spack_env, run_env):
         version = str(self.spec.version.up_to(2).dotted)
         prefix_version = version
         if self.spec.satisfies('@16.1'):
             prefix_version = '2016.05'
         
-        prefix = self.prefix
-        mcfd_prefix = '{0}/mlib/mcfd.{1}'.format(prefix, version)
+        prefix = str(self.prefix)
+        mcfd_prefix = self.mcfd_prefix
 
         run_env.set('CFDPLUSPLUS_ROOT', prefix)
         run_env.set('CFDPLUSPLUS_INCLUDE', prefix + '/include')
         run_env.set('CFDPLUSPLUS_LIBRARY', prefix + '/lib')
         run_env.set('CFDPLUSPLUS_PATH', mcfd_prefix + '/exec')
-        run_env.prepend_path('LD_LIBRARY_PATH', prefix + '/lib')
-        run_env.prepend_path('LD_LIBRARY_PATH', prefix + '/glib')
+        if self.lib_dirs:
+            run_env.prepend_path('LD_LIBRARY_PATH', ':'.join(self.lib_dirs))
         run_env.set('METACOMP_LICENSE_FILE', prefix + '/Lics/Metacomp.lic')
         run_env.set('METACOMP_HOME', prefix + '')
         run_env.set('MCFD_HOME', mcfd_prefix)
-        run_env.prepend_path('PATH', mcfd_prefix + '/exec')
-        run_env.set('MCFD_TCLTK', mcfd_prefix + '/exec/gui_src')
+        # bin holds the wrappers of the solvers in exec
+        for exec_dir in existing_paths(prefix, (mcfd_prefix + '/exec',
+                                                prefix + '/bin')):
+            run_env.prepend_path('PATH', exec_dir)
         run_env.set('MCFD_HTML', mcfd_prefix + '/html')
         run_env.set('MCFD_VERSION', version)
-        run_env.set('MCFD_PAR_LIC_MODE', '2')
-        run_env.set('MCFD_MAXMEM', '512G')
-        run_env.set('MCFD_PROCMEM', '32G')
+        run_env.set('MCFD_PAR_LIC_MODE',
+                    self.spec.variants['par_lic_mode'].value)
         run_env.set('MCFD_GUIOPT1', 'MCFD_GUI_TNEQC')
-        run_env.set('MCFD_TOGL', 'yes')
-        run_env.set('TCL_LIBRARY', prefix + '/mlib/tcltk8/lib/tcl8.0')
-        run_env.set('TK_LIBRARY', prefix + '/mlib/tcltk8/lib/tk8.0')
+        if '+gui' in self.spec:
+            run_env.set('MCFD_TCLTK', mcfd_prefix + '/exec/gui_src')
+            run_env.set('MCFD_TOGL', 'yes')
+            run_env.set('TCL_LIBRARY', prefix + '/mlib/tcltk8/lib/tcl8.0')
+            run_env.set('TK_LIBRARY', prefix + '/mlib/tcltk8/lib/tk8.0')
         run_env.set('MPATH', prefix + '/mbin')
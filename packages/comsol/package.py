@@ -24,9 +24,58 @@
 ##############################################################################
 
 from spack import *
+from spack.pkg.scitasexternal.binary_payload import (BinaryPayload,
+                                                     scratch_chain,
+                                                     write_script)
 
+# Wrapper running comsol on the Slurm job, with the temporary and recovery
+# files on the local disk of the nodes. Cluster computing is used for jobs
+# of several tasks, each task being a process with its CPUs as threads.
+_slurm_wrapper = """#!/bin/bash
+SCRATCH={scratch}
+DIRECTORIES=("$SCRATCH/comsol-tmp" "$SCRATCH/comsol-recovery")
+if [ "${{SLURM_JOB_NUM_NODES:-1}}" -gt 1 ]; then
+    # Once on every node of the job, the remote processes write there too
+    srun --ntasks="$SLURM_JOB_NUM_NODES" --ntasks-per-node=1 \\
+        mkdir -p "${{DIRECTORIES[@]}}"
+else
+    mkdir -p "${{DIRECTORIES[@]}}"
+fi
+OPTIONS=(-tmpdir "$SCRATCH/comsol-tmp" -recoverydir "$SCRATCH/comsol-recovery")
 
-class Comsol(Package):
+if [ -n "$SLURM_CPUS_PER_TASK" ]; then
+    OPTIONS+=(-np "$SLURM_CPUS_PER_TASK")
+fi
+
+if [ "${{SLURM_NTASKS:-1}}" -gt 1 ]; then
+    OPTIONS+=(-nn "$SLURM_NTASKS")
+    if [ -n "$SLURM_NTASKS_PER_NODE" ]; then
+        OPTIONS+=(-nnhost "$SLURM_NTASKS_PER_NODE")
+    fi
+{bootstrap}
+fi
+
+exec "{comsol}" "$@" "${{OPTIONS[@]}}"
+"""
+
+# How the MPI processes are started on the nodes of the job
+_slurm_bootstrap = """    OPTIONS+=(-mpibootstrap slurm)"""
+_ssh_bootstrap = """    HOSTFILE="$SCRATCH/comsol-hosts"
+    scontrol show hostnames "$SLURM_JOB_NODELIST" > "$HOSTFILE"
+    OPTIONS+=(-f "$HOSTFILE" -mpirsh ssh)"""
+
+
+def write_slurm_wrapper(path, comsol, bootstrap, scratch_variables):
+    """Writes comsol-slurm to path, running comsol with the MPI bootstrap
+    of the version and the scratch in the first of scratch_variables that
+    is set, or /tmp."""
+    write_script(path, _slurm_wrapper.format(
+        scratch=scratch_chain(scratch_variables, '/tmp'),
+        comsol=comsol,
+        bootstrap=bootstrap))
+
+
+class Comsol(BinaryPayload):
     """Comsol Multiphysics is a general-purpose software platform
     for modeling and simulating physics-based problems.
     """
@@ -43,5 +92,24 @@ class Comsol(Package):
     version('5.3')
     version('5.2a')
 
+    # Variables holding node-local scratch, in order of preference
+    scratch_variables = ['SLURM_TMPDIR', 'TMPDIR']
+
     def install(self, spec, prefix):
         pass
+
+    def install_scripts(self):
+        """Installs comsol-slurm next to comsol."""
+        # Only the Intel MPI of 5.4 and later starts processes with srun
+        if self.spec.satisfies('@5.4:'):
+            bootstrap = _slurm_bootstrap
+        else:
+            bootstrap = _ssh_bootstrap
+
+        mkdirp(self.prefix.bin)
+        write_slurm_wrapper(join_path(self.prefix.bin, 'comsol-slurm'),
+                            join_path(self.prefix.bin, 'comsol'),
+                            bootstrap, self.scratch_variables)
+
+    def setup_environment(self, spack_env, run_env):
+        run_env.prepend_path('PATH', self.prefix.bin)
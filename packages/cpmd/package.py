@@ -23,7 +23,83 @@
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
 ##############################################################################
 from spack import *
-from distutils.dir_util import copy_tree
+from spack.pkg.scitasexternal.binary_payload import (PAYLOAD_MANIFEST,
+                                                     check_payload,
+                                                     copy_tree_parallel)
+
+import llnl.util.tty as tty
+import os
+import re
+import time
+
+# Fortran module definitions and uses, and the object targets of a makefile
+_module_re = re.compile(r'^\s*module\s+(\w+)\s*(?:!.*)?$', re.I | re.M)
+_use_re = re.compile(r'^\s*use\s*(?:,\s*\w+\s*::\s*|::\s*)?(\w+)',
+                     re.I | re.M)
+_object_re = re.compile(r'(?:^|\s)([^\s:$#=\\]+\.o)(?=[\s:\\]|$)', re.M)
+
+
+def module_dependencies(sources):
+    """Returns, for each of sources using Fortran modules defined in
+    sources, the sorted sources defining them."""
+    defined = {}
+    uses = {}
+    for source in sources:
+        with open(source, errors='replace') as f:
+            text = f.read()
+        for name in _module_re.findall(text):
+            if name.lower() != 'procedure':
+                defined[name.lower()] = source
+        uses[source] = set(name.lower() for name in _use_re.findall(text))
+
+    dependencies = {}
+    for source, names in uses.items():
+        needed = set(defined[name] for name in names if name in defined)
+        needed.discard(source)
+        if needed:
+            dependencies[source] = sorted(needed)
+    return dependencies
+
+
+def dependency_rules(makefile, sources):
+    """Returns the make rules building the objects of sources after the
+    objects of the modules they use, for the objects named in makefile as
+    rule targets or in lists of objects."""
+    with open(makefile) as f:
+        targets = dict((os.path.basename(target), target)
+                       for target in _object_re.findall(f.read()))
+
+    def target(source):
+        name = os.path.splitext(os.path.basename(source))[0] + '.o'
+        if name not in targets:
+            tty.debug('No target for {0} in {1}'.format(source, makefile))
+        return targets.get(name)
+
+    rules = []
+    for source, needed in sorted(module_dependencies(sources).items()):
+        obj = target(source)
+        prerequisites = [name for name in map(target, needed) if name]
+        if obj and prerequisites:
+            rules.append('{0}: {1}'.format(obj, ' '.join(prerequisites)))
+    return rules
+
+
+def add_module_dependencies(makefile, sources):
+    """Appends the rules of dependency_rules to makefile, so that make -j
+    builds each module before its users. Returns the number of rules."""
+    rules = dependency_rules(makefile, sources)
+    if rules:
+        with open(makefile, 'a') as f:
+            f.write('\n# Fortran module dependencies\n')
+            f.write('\n'.join(rules) + '\n')
+    return len(rules)
+
+
+def fortran_sources(root):
+    """Returns the Fortran sources of the tree root."""
+    return sorted(join_path(directory, name)
+                  for directory, _, names in os.walk(root) for name in names
+                  if name.lower().endswith(('.f90', '.f')))
 
 
 class Cpmd(Package):
@@ -38,12 +114,33 @@ class Cpmd(Package):
     version('v4.1', 'f70aedefa2e5f8a5f8d79afdd99d0895')
 
     variant('openmp', default=False, description='Enables openMP support')
+    variant('fft', default='fftw3', values=('fftw3', 'mkl'),
+            description='FFT backend, FFTW3 or the MKL DFTI through its '
+                        'FFTW3 interface')
+    variant('optimize', default=False,
+            description='Compile with -O3 and the flags of the target '
+                        'microarchitecture')
 
     depends_on('mpi')
     depends_on('blas')
     depends_on('lapack')
-    depends_on('fftw', when='~openmp')
-    depends_on('fftw+openmp', when='+openmp')
+    depends_on('fftw', when='fft=fftw3 ~openmp')
+    depends_on('fftw+openmp', when='fft=fftw3 +openmp')
+    depends_on('intel-mkl', when='fft=mkl')
+    # With OpenMP, BLAS and LAPACK have to be the threaded flavor as well
+    depends_on('intel-mkl threads=openmp', when='+openmp ^intel-mkl')
+    depends_on('openblas threads=openmp', when='+openmp ^openblas')
+
+    @property
+    def fft_libs(self):
+        spec = self.spec
+        if 'fft=mkl' in spec:
+            return spec['intel-mkl'].libs.ld_flags
+
+        fftwlib = '-L%s' % spec['fftw'].prefix.lib
+        if '+openmp' in spec:
+            fftwlib += ' -lfftw3_omp'
+        return fftwlib + ' -lfftw3'
 
     def install(self, spec, prefix):
         bash = which('bash')
@@ -59,32 +156,52 @@ class Cpmd(Package):
 
         elif '%gcc' in self.spec:
             architecture = 'LINUX-I686-FEDORA-MPI-FFTW'
-            # by default CPMD use FFTW when compiled with gnu
-            # It's better FFTW3
-            filter_file('(CPPFLAGS=)(\')(.+)(\')', r'\1\2\3%s\4' %
-                        ' -D__HAS_FFT_FFTW3', 'configure/%s' % architecture)
             # the option -ffree-line-length-none is necessary to avoid
             # errors occurring when a line is too long
             filter_file('(FFLAGS=)(\')(.+)(\')', r'\1\2\3%s\4' %
                         ' -ffree-line-length-none', 'configure/%s' %
                         architecture)
 
-            libs = ''
-            libs += str(spec['blas'].libs)
-            if '+openmp' in spec:
-                string = spec['fftw'].prefix.lib
-                fftwlib = ' -L%s' % string + ' -lfftw3_omp -lfftw3'
-            else:
-                string = spec['fftw'].prefix.lib
-                fftwlib = ' -L%s' % string + ' -lfftw3'
-            libs += fftwlib
-            filter_file('(LIBS=)(\')(.+)(\')', r'\1\2%s\4' % libs,
-                        'configure/%s' % architecture)
+        # by default CPMD uses its own FFT or FFTW2, FFTW3 is better and
+        # is also the interface through which MKL is used
+        fft_flags = ' -D__HAS_FFT_FFTW3'
+        if 'fft=mkl' in spec:
+            fft_flags += ' -I%s' % join_path(
+                spec['intel-mkl'].headers.directories[0], 'fftw')
+        filter_file('-D__HAS_FFT_DEFAULT', '', 'configure/%s' % architecture)
+        filter_file('(CPPFLAGS=)(\')(.+)(\')', r'\1\2\3%s\4' % fft_flags,
+                    'configure/%s' % architecture)
+
+        libs = ' '.join([spec['lapack'].libs.ld_flags,
+                         spec['blas'].libs.ld_flags, self.fft_libs])
+        filter_file('(LIBS=)(\')(.+)(\')', r'\1\2%s\4' % libs,
+                    'configure/%s' % architecture)
+
+        if '+optimize' in spec:
+            flags = ' -O3 %s' % spec.target.optimization_flags(spec.compiler)
+            for variable in ('FFLAGS', 'CFLAGS'):
+                filter_file('(%s=)(\')(.+)(\')' % variable,
+                            r'\1\2\3%s\4' % flags,
+                            'configure/%s' % architecture)
 
         if '+openmp' in spec:
             bash('-c', 'export omp=1;./configure.sh %s' % architecture)
         else:
             bash('-c', './configure.sh %s' % architecture)
 
-        make(parallel=False)
-        copy_tree('bin', self.prefix.bin)
+        # The makefile generated by configure.sh does not order the Fortran
+        # modules, the objects using a module are made to depend on the one
+        # defining it so that the whole build runs in parallel
+        start = time.time()
+        if add_module_dependencies('Makefile', fortran_sources('src')):
+            make()
+        else:
+            tty.warn('No Fortran module dependency found in {0}, building '
+                     'serially'.format(os.getcwd()))
+            make(parallel=False)
+        tty.msg('Built CPMD in {0:.0f}s'.format(time.time() - start))
+        copy_tree_parallel('bin', self.prefix.bin, jobs=make_jobs,
+                           manifest=join_path(prefix, PAYLOAD_MANIFEST))
+
+    def test(self):
+        check_payload(join_path(self.prefix, PAYLOAD_MANIFEST))
@@ -4,7 +4,10 @@
 # SPDX-License-Identifier: (Apache-2.0 OR MIT)
 
 from spack import *
+from spack.pkg.scitasexternal.binary_payload import copy_tree_parallel
+from concurrent.futures import ThreadPoolExecutor
 import os
+import shutil
 
 
 class Crystal17(Package):
@@ -27,33 +30,138 @@ class Crystal17(Package):
             description='Builds replicated data binary (Pcrystal)')
     variant('mppcrystal', default=True,
             description='Builds distributed data binary (MPPcrystal)')
+    variant('threads', default='sequential', values=('sequential', 'openmp'),
+            description='Link the sequential or the OpenMP threaded MKL')
 
     depends_on('blas')
     depends_on('lapack')
     depends_on('mpi', when='+pcrystal')
     depends_on('mpi', when='+mppcrystal')
-    # Currently only builds with Intel
-    conflicts('%gcc')
+    # MKL provides ScaLAPACK with Intel, GCC builds need it explicitly
+    depends_on('scalapack', when='+mppcrystal %gcc')
+
+    @property
+    def flavors(self):
+        """Returns the (name, make targets) of the binaries to build."""
+        flavors = [('serial', [])]
+        if self.spec.satisfies('+pcrystal'):
+            flavors.append(('parallel', ['parallel']))
+        if self.spec.satisfies('+mppcrystal'):
+            flavors.append(('MPP', ['MPP']))
+        return flavors
+
+    @property
+    def arch(self):
+        if self.spec.satisfies('%gcc'):
+            return 'Linux-gfortran'
+        return 'Linux-intel'
+
+    def write_gfortran_inc(self, inc):
+        """Writes the Xmakes include for GNU Fortran, linking the BLAS,
+        LAPACK and ScaLAPACK of the spec instead of MKL."""
+        spec = self.spec
+        if spec.satisfies('+pcrystal') or spec.satisfies('+mppcrystal'):
+            f90 = spec['mpi'].mpifc
+        else:
+            f90 = self.compiler.fc
+
+        f90flags = ['-O3', spec.target.optimization_flags(spec.compiler),
+                    '-ffree-line-length-none']
+        if spec.satisfies('%gcc@10:'):
+            f90flags.append('-fallow-argument-mismatch')
+        if spec.satisfies('threads=openmp'):
+            f90flags.append('-fopenmp')
+
+        libs = spec['lapack'].libs + spec['blas'].libs
+        mpplib = ''
+        if spec.satisfies('+mppcrystal'):
+            mpplib = spec['scalapack'].libs.ld_flags
+
+        with open(inc, 'w') as xmakes:
+            xmakes.write('\n'.join([
+                '# For Linux, using GNU Fortran, generated by Spack',
+                '',
+                'MPIBIN  = ',
+                'F90     = %s' % f90,
+                'LD      = $(F90)',
+                'PLD     = $(F90)',
+                '',
+                'F90FLAGS = %s' % ' '.join(f90flags),
+                'F90FIXED = -ffixed-form',
+                'F90FREE  = -ffree-form',
+                'SAVEMOD = -J $(MODDIR)',
+                'INCMOD  = -I$(MODDIR)',
+                'LDFLAGS = $(F90FLAGS)',
+                'LDLIBS  = -Lxcfun xcfun/libxcfun.a %s -lstdc++ -lm' %
+                libs.ld_flags,
+                '',
+                'MXMB    = $(OBJDIR)/libmxm.o',
+                '',
+                'MACHINE_C=mach_linux',
+                '',
+                'CC=%s' % self.compiler.cc,
+                'CFLAGS=-O2 -DNDEBUG',
+                'CXX=%s' % self.compiler.cxx,
+                'CXXFLAGS=$(CFLAGS) -fno-rtti -fno-exceptions',
+                '',
+                '# MPI harness',
+                'HARNESS = $(MPI)',
+                '',
+                'MPPLIB=%s' % mpplib,
+                '']))
 
     def install(self, spec, prefix):
-        os.chdir("build")
-        filter_file(r'^ARCH =.*', 'ARCH = Linux-intel', 'Makefile')
-        filter_file(r'^BINDIR .*', 'BINDIR = bin', 'Makefile')
-        if spec.satisfies('~pcrystal') and spec.satisfies('~mppcrystal'):
-            filter_file(r'^F90     =.*', 'F90     = %s' % self.compiler.fc,
-                        'Xmakes/Linux-intel.inc')
-
-        # Make serial version
-        make()
-        # and parallel versions
+        with working_dir('build'):
+            filter_file(r'^ARCH =.*', 'ARCH = %s' % self.arch, 'Makefile')
+            filter_file(r'^BINDIR .*', 'BINDIR = bin', 'Makefile')
+            inc = 'Xmakes/%s.inc' % self.arch
+            if spec.satisfies('%gcc'):
+                self.write_gfortran_inc(inc)
+            else:
+                if (spec.satisfies('~pcrystal') and
+                        spec.satisfies('~mppcrystal')):
+                    filter_file(r'^F90     =.*',
+                                'F90     = %s' % self.compiler.fc, inc)
+
+                # Tune for the target of the spec, not for the build host
+                filter_file('-xHost',
+                            spec.target.optimization_flags(spec.compiler),
+                            inc)
+                if spec.satisfies('threads=openmp'):
+                    filter_file('-mkl=sequential', '-qopenmp -mkl=parallel',
+                                inc)
+
+        # The Makefile derives its object directory from ROOTDIR, itself
+        # $(PWD)/.., which make -C does not update. Each flavor is built
+        # concurrently in its own copy of the whole tree, with ROOTDIR and
+        # PWD pointing to that copy.
+        flavors = self.flavors
+        roots = {}
+        for name, _ in flavors:
+            roots[name] = join_path(self.stage.path, 'crystal-%s' % name)
+            shutil.copytree(self.stage.source_path, roots[name],
+                            symlinks=True)
+
+        jobs = '-j%d' % max(1, make_jobs // len(flavors))
+        with ThreadPoolExecutor(max_workers=len(flavors)) as executor:
+            builds = [executor.submit(
+                make, '-C', join_path(roots[name], 'build'),
+                'ROOTDIR=%s' % roots[name],
+                'PWD=%s' % join_path(roots[name], 'build'),
+                jobs, *targets, parallel=False)
+                for name, targets in flavors]
+            for build in builds:
+                build.result()
+
+        for name, _ in flavors:
+            copy_tree_parallel(join_path(roots[name], 'build', 'bin'),
+                               prefix.bin, jobs=make_jobs)
         if spec.satisfies('+pcrystal'):
-            make('parallel')
-            install_tree('utils17_mpi', 'bin')
+            copy_tree_parallel(join_path('build', 'utils17_mpi'),
+                               prefix.bin, jobs=make_jobs)
         if spec.satisfies('+mppcrystal'):
-            make('MPP')
-            install_tree('utils17_mpp', 'bin')
-
-        install_tree('bin', spec.prefix.bin)
+            copy_tree_parallel(join_path('build', 'utils17_mpp'),
+                               prefix.bin, jobs=make_jobs)
 
     def setup_environment(self, spack_env, run_env):
         run_env.set('CRY17_ROOT', self.prefix)
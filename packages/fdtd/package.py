@@ -23,9 +23,45 @@
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
 ##############################################################################
 from spack import *
+from spack.pkg.scitasexternal.binary_payload import (BinaryPayload,
+                                                     write_script)
+import re
 
 
-class Fdtd(Package):
+def parse_version(version):
+    """Splits a version of either naming scheme into (major, release,
+    build), which sort in release order across both.
+
+    The major number is the year of the release from 2020 on, e.g.
+    2020-R2.4-2502 is (2020, (2, 4), 2502), and 8 before, e.g. 8.24.2387 is
+    (8, (24,), 2387). Package revisions (8.19.1416-1) are left out.
+    """
+    version = str(version)
+    match = (re.match(r'^(\d{4})-R([\d.]+)-(\d+)$', version) or
+             re.match(r'^(\d)\.(\d+)\.(\d+)(?:-\d+)?$', version))
+    if not match:
+        raise ValueError('Unknown FDTD version {0}'.format(version))
+    major, release, build = match.groups()
+    return (int(major), tuple(int(n) for n in release.split('.')),
+            int(build))
+
+
+# Engines of each MPI, with the first version shipping them
+_engines = {
+    'intel-mpi': ('fdtd-engine-impi-lcl', (8, (20,), 0)),
+    'intel-oneapi-mpi': ('fdtd-engine-impi-lcl', (8, (20,), 0)),
+    'openmpi': ('fdtd-engine-ompi-lcl', (8, (12,), 0)),
+    'mpich': ('fdtd-engine-mpich2nem', (8, (12,), 0)),
+}
+
+# Runs the engine of the MPI of the spec, as one rank of an MPI launch,
+# with a thread per CPU of the Slurm task
+_engine_wrapper = """#!/bin/sh
+exec "{engine}" -t "${{SLURM_CPUS_PER_TASK:-1}}" "$@"
+"""
+
+
+class Fdtd(BinaryPayload):
     """3D/2D Maxwell's solver for nanophotonic devices."""
 
     homepage = "https://www.lumerical.com/products/fdtd/"
@@ -42,3 +78,44 @@ class Fdtd(Package):
     version("8.19.1416-1")
     version("8.18.1365-1")
     version("8.12.527")
+
+    depends_on('mpi', type='run')
+
+    # Only these MPIs have an engine, Intel MPI from 8.20 on
+    conflicts('^mvapich2')
+    conflicts('^spectrum-mpi')
+    conflicts('^mpt')
+    conflicts('^intel-mpi', when='@:8.19')
+    conflicts('^intel-oneapi-mpi', when='@:8.19')
+
+    @property
+    def engine(self):
+        """Path to the engine matching the MPI of the spec, None if this
+        version has none."""
+        mpi = self.spec['mpi'].name
+        if mpi not in _engines:
+            return None
+        engine, since = _engines[mpi]
+        if parse_version(self.spec.version) < since:
+            return None
+        return join_path(self.prefix.bin, engine)
+
+    def install(self, spec, prefix):
+        pass
+
+    def install_scripts(self):
+        """Installs fdtd-engine-slurm, to be started by srun or mpirun."""
+        engine = self.engine
+        if engine is None:
+            raise InstallError(
+                'FDTD {0} has no engine for {1}, use one of {2}'.format(
+                    self.spec.version, self.spec['mpi'].name,
+                    ', '.join(sorted(_engines))))
+        mkdirp(self.prefix.bin)
+        write_script(join_path(self.prefix.bin, 'fdtd-engine-slurm'),
+                     _engine_wrapper.format(engine=engine))
+
+    def setup_environment(self, spack_env, run_env):
+        run_env.prepend_path('PATH', self.prefix.bin)
+        if self.engine:
+            run_env.set('FDTD_ENGINE', self.engine)
@@ -24,8 +24,101 @@
 ##############################################################################
 
 from spack import *
+from spack.pkg.scitasexternal.binary_payload import (LIBRARY_INDEX,
+                                                     PAYLOAD_MANIFEST,
+                                                     check_payload,
+                                                     copy_tree_parallel,
+                                                     existing_paths,
+                                                     link_library_index,
+                                                     scratch_chain,
+                                                     write_script)
 
-import distutils.dir_util
+import os
+
+
+# Binary flavors of Gaussian, from the fastest to the most portable, with the
+# CPU flag each one requires and the subdirectory of the prefix holding it.
+_flavors = [
+    ('avx512', 'avx512f', 'avx512'),
+    ('avx2', 'avx2', 'avx2'),
+    ('avx', 'avx', 'avx'),
+    ('generic', None, ''),
+]
+
+# Wrapper running g16 with defaults derived from the Slurm job it runs in,
+# outside of a job or where the user set them the Gaussian defaults apply.
+_g16_wrapper = """#!/bin/bash
+{flavor_selection}
+if [ -n "$SLURM_JOB_ID" ]; then
+    SCRATCH={scratch}
+    if [ -z "$GAUSS_SCRDIR" ] && [ -n "$SCRATCH" ]; then
+        export GAUSS_SCRDIR="$SCRATCH"
+    fi
+
+    CPUS=${{SLURM_CPUS_PER_TASK:-0}}
+    if [ -z "$GAUSS_PDEF" ] && [ "$CPUS" -gt 0 ]; then
+        export GAUSS_PDEF=$CPUS
+    fi
+
+    MEMORY=${{SLURM_MEM_PER_NODE:-0}}
+    if [ "$MEMORY" -eq 0 ] && [ "$CPUS" -gt 0 ]; then
+        MEMORY=$(( ${{SLURM_MEM_PER_CPU:-0}} * CPUS ))
+    fi
+    if [ -z "$GAUSS_MDEF" ] && [ "$MEMORY" -gt 0 ]; then
+        export GAUSS_MDEF="$(( MEMORY * {memory_percent} / 100 ))MB"
+    fi
+
+    if [ -z "$GAUSS_WDEF" ] && [ "${{SLURM_JOB_NUM_NODES:-1}}" -gt 1 ]; then
+        GAUSS_WDEF=$(scontrol show hostnames "$SLURM_JOB_NODELIST" |
+                     paste -sd , -)
+        export GAUSS_WDEF
+    fi
+fi
+
+exec "$g16root/g16/g16" "$@"
+"""
+
+# Runs the fastest flavor installed that the CPU of the node supports, in
+# place of the generic one set by the module. Each flavor is given as
+# flag:root.
+_flavor_selection = """FLAGS=" $(grep -m 1 '^flags' "{cpuinfo}" | cut -d: -f2) "
+for FLAVOR in {flavors}; do
+    ROOT=${{FLAVOR#*:}}
+    case "$FLAGS" in
+        *" ${{FLAVOR%%:*}} "*) [ -d "$ROOT/g16" ] && break ;;
+    esac
+    ROOT=
+done
+if [ -n "$ROOT" ]; then
+    G16=$ROOT/g16
+    DIRS=$G16:$G16/bsd:$G16/local
+    export g16root=$ROOT GAUSS_BSDDIR=$G16/bsd
+    export GAUSS_LEXEDIR=$G16/linda-exe GAUSS_ARCHDIR=$G16/arch
+    export GAUSS_EXEDIR=$DIRS${{GAUSS_EXEDIR:+:$GAUSS_EXEDIR}}
+    export LD_LIBRARY_PATH=$DIRS${{LD_LIBRARY_PATH:+:$LD_LIBRARY_PATH}}
+fi
+"""
+
+
+def write_g16_wrapper(path, scratch_variables, memory_fraction, flavors=(),
+                      cpuinfo='/proc/cpuinfo'):
+    """Writes the g16 wrapper to path, taking the scratch from the first of
+    scratch_variables that is set and memory_fraction of the job memory.
+
+    flavors are the (CPU flag, root) of the optimized flavors to choose
+    from on each node, fastest first, with the flags of the node read from
+    cpuinfo. Without them the g16 of the module runs.
+    """
+    selection = ''
+    if flavors:
+        selection = _flavor_selection.format(
+            cpuinfo=cpuinfo,
+            flavors=' '.join('"{0}:{1}"'.format(flag, root)
+                             for flag, root in flavors))
+    write_script(path, _g16_wrapper.format(
+        flavor_selection=selection,
+        scratch=scratch_chain(scratch_variables),
+        memory_percent=int(round(memory_fraction * 100))))
 
 
 class Gaussian(Package):
@@ -39,37 +132,122 @@ class Gaussian(Package):
     version('g16-C.01')
     version('g16-A.03')
 
+    variant('libindex', default=False,
+            description='Resolve shared libraries through a per-install '
+                        'index instead of a LD_LIBRARY_PATH chain')
+
+    variant('flavor', default='auto',
+            values=('auto',) + tuple(name for name, _, _ in _flavors),
+            description='Binary flavor to run, auto picks the fastest one '
+                        'installed that the CPU of each node supports')
+
+    # Variables holding node-local scratch, in order of preference
+    scratch_variables = ['SLURM_TMPDIR', 'TMPDIR']
+
+    # Share of the allocated memory given to Gaussian by default, the rest
+    # is left for the Linda workers and the buffers outside of %Mem
+    memory_fraction = 0.8
+
+    @property
+    def flavor(self):
+        """Returns the name and the root directory of the flavor set by the
+        module, the generic one unless a flavor is pinned. With auto, the
+        g16 wrapper runs the best flavor of each node instead."""
+        pinned = self.spec.variants['flavor'].value
+        for name, _, subdir in _flavors:
+            if name == pinned:
+                return name, join_path(self.prefix, subdir)
+        return 'generic', str(self.prefix)
+
+    @property
+    def g16_root(self):
+        return self.flavor[1]
+
+    @property
+    def exec_dirs(self):
+        g16_dir = join_path(self.g16_root, 'g16')
+        return existing_paths(str(self.prefix), (
+            g16_dir,
+            join_path(g16_dir, 'bsd'),
+            join_path(g16_dir, 'local'),
+            join_path(self.prefix, 'gv', 'bin'),
+            join_path(self.prefix, 'gv'),
+        ))
+
+    @property
+    def lib_dirs(self):
+        return existing_paths(
+            str(self.prefix), (join_path(self.prefix, 'gv', 'lib'),)
+        ) + self.exec_dirs
+
     def install(self, spec, prefix):
-        distutils.dir_util.copy_tree(".", prefix + '/g09')
+        # The archive holds a single flavor, auto installs it as the generic
+        # one and other flavors can be added next to it
+        pinned = spec.variants['flavor'].value
+        subdir = dict((name, sub) for name, _, sub in _flavors).get(pinned, '')
+        copy_tree_parallel('.', join_path(prefix, subdir, 'g16'),
+                           jobs=make_jobs,
+                           manifest=join_path(prefix, PAYLOAD_MANIFEST))
+
+    @run_after('install')
+    def check_flavor(self):
+        """Fails the installation if the flavor the module sets is not
+        installed, or if it is pinned and the target does not support
+        it."""
+        name, root = self.flavor
+        feature = dict((flavor, flag) for flavor, flag, _ in _flavors)[name]
+        if feature and feature not in self.spec.target:
+            raise InstallError(
+                'Gaussian flavor {0} needs {1}, which {2} does not '
+                'support'.format(name, feature, self.spec.target))
+        if not os.path.isdir(join_path(root, 'g16')):
+            raise InstallError('Gaussian flavor {0} is not installed in '
+                               '{1}'.format(name, root))
+
+    @run_after('install')
+    def install_wrapper(self):
+        """Installs the g16 wrapper, which runs the g16 of the flavor."""
+        flavors = []
+        if self.spec.variants['flavor'].value == 'auto':
+            flavors = [(flag, join_path(self.prefix, subdir))
+                       for _, flag, subdir in _flavors if flag]
+        mkdirp(self.prefix.bin)
+        write_g16_wrapper(join_path(self.prefix.bin, 'g16'),
+                          self.scratch_variables, self.memory_fraction,
+                          flavors)
+
+    @run_after('install')
+    def install_library_index(self):
+        if '+libindex' in self.spec:
+            link_library_index(self.prefix, self.lib_dirs)
+
+    def test(self):
+        check_payload(join_path(self.prefix, PAYLOAD_MANIFEST))
 
     def setup_environment(self, spack_env, run_env):
 
         prefix = self.prefix
 
-        vector_instructions = ''
-        if 'avx2' in self.spec.target:
-            vector_instructions = 'avx2'
-        elif 'avx' in self.spec.target:
-            vector_instructions = 'avx'
-
-        g16_root = join_path(prefix, vector_instructions)
+        g16_root = self.g16_root
         g16_dir = join_path(g16_root, 'g16')
 
         run_env.set('g16root', g16_root)
 
-        exec_dirs = [
-            g16_dir,
-            join_path(g16_dir, 'bsd'),
-            join_path(g16_dir, 'local'),
-            join_path(prefix, 'gv', 'bin'),
-            join_path(prefix, 'gv'),
-        ]
+        exec_dirs = self.exec_dirs
 
         run_env.set('GAUSS_EXEDIR', ':'.join(exec_dirs))
 
         run_env.set('GAUSS_LEXEDIR', join_path(g16_dir, 'linda-exe'))
         run_env.set('GAUSS_ARCHDIR', join_path(g16_dir, 'arch'))
         run_env.set('GAUSS_BSDDIR', join_path(g16_dir, 'bsd'))
-        run_env.prepend_path('PATH', ':'.join(exec_dirs))
-        run_env.prepend_path('LD_LIBRARY_PATH', ':'.join(exec_dirs))
-        run_env.prepend_path('LD_LIBRARY_PATH', join_path(prefix, 'gv', 'lib'))
+        if exec_dirs:
+            run_env.prepend_path('PATH', ':'.join(exec_dirs))
+        # bin holds the g16 wrapper, found before the g16 of the flavor
+        for bin_dir in existing_paths(str(prefix), (prefix.bin,)):
+            run_env.prepend_path('PATH', bin_dir)
+
+        index = join_path(prefix, LIBRARY_INDEX)
+        if '+libindex' in self.spec and os.path.isdir(index):
+            run_env.prepend_path('LD_LIBRARY_PATH', index)
+        elif self.lib_dirs:
+            run_env.prepend_path('LD_LIBRARY_PATH', ':'.join(self.lib_dirs))
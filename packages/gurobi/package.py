@@ -20,8 +20,30 @@
 # See the Spack documentation for more information on packaging.
 # ----------------------------------------------------------------------------
 from spack import *
+from spack.pkg.scitasexternal.binary_payload import (LIBRARY_INDEX,
+                                                     copy_tree_parallel,
+                                                     link_library_index,
+                                                     write_script)
 import os
 
+# Wrapper passing Threads from the CPUs per task of the Slurm job, unless it
+# is given on the command line
+_threads_wrapper = """#!/bin/sh
+threads=${{SLURM_CPUS_PER_TASK:-}}
+for arg in "$@"; do
+    case "$arg" in
+        [Tt][Hh][Rr][Ee][Aa][Dd][Ss]=*) threads= ;;
+    esac
+done
+exec "{program}" ${{threads:+Threads=$threads}} "$@"
+"""
+
+
+def write_threads_wrapper(path, program):
+    """Writes a wrapper of program to path, capping its threads to the job.
+    """
+    write_script(path, _threads_wrapper.format(program=program))
+
 
 class Gurobi(Package):
     """The Gurobi Optimizer was designed from the ground up to be the fastest,
@@ -43,18 +65,104 @@ class Gurobi(Package):
     version('8.1.1', sha256='c030414603d88ad122246fe0e42a314fab428222d98e26768480f1f870b53484')
     version('7.5.2', sha256='d2e6e2eb591603d57e54827e906fe3d7e2e0e1a01f9155d33faf5a2a046d218e')
 
+    variant('libindex', default=False,
+            description='Resolve shared libraries through a per-install '
+                        'index instead of a LD_LIBRARY_PATH chain')
+    variant('tokenserver', default='none', values=lambda x: True,
+            description='Token server (host or host:port) to take the '
+                        'licenses from instead of a license file')
+    variant('csmanager', default='none', values=lambda x: True,
+            description='Compute Server cluster manager URL to send the '
+                        'solves to')
+    variant('python', default=False,
+            description='Install gurobipy for the Spack Python')
+
+    extends('python', when='+python')
+    depends_on('python', when='+python', type=('build', 'run'))
+
     # Licensing
-    license_required = True
     license_files    = ['gurobi.lic']
     license_vars     = ['GRB_LICENSE_FILE']
     license_url      = 'http://www.gurobi.com/downloads/download-center'
 
+    # Wrapped so that they use the CPUs of the Slurm allocation
+    wrapped_programs = ['gurobi_cl']
+
+    @property
+    def license_required(self):
+        # The token server and Compute Server licenses are generated
+        return not self.license_settings
+
+    @property
+    def license_settings(self):
+        settings = []
+        tokenserver = self.spec.variants['tokenserver'].value
+        if tokenserver != 'none':
+            host, _, port = tokenserver.partition(':')
+            settings.append('TOKENSERVER={0}'.format(host))
+            if port:
+                settings.append('PORT={0}'.format(port))
+        csmanager = self.spec.variants['csmanager'].value
+        if csmanager != 'none':
+            settings.append('CSMANAGER={0}'.format(csmanager))
+        return settings
+
     def url_for_version(self, version):
         url = "https://packages.gurobi.com/{0}/gurobi{1}_linux64.tar.gz"
         return url.format(version.up_to(2), version)
 
+    @property
+    def lib_dirs(self):
+        return [join_path(self.prefix, 'linux64', 'lib')]
+
+    @property
+    def libs(self):
+        lib_dir = self.lib_dirs[0]
+        version = self.version.up_to(2).joined
+        # libgurobi_c++ uses libgurobiXY, so it comes first
+        return (find_libraries('libgurobi_c++', lib_dir, shared=False) +
+                find_libraries('libgurobi{0}'.format(version), lib_dir))
+
     def install(self, spec, prefix):
-        install_tree('linux64', join_path(prefix, 'linux64'))
+        # The C++ library is shipped for one ABI only, it is rebuilt with
+        # the compiler of the spec
+        with working_dir(join_path('linux64', 'src', 'build')):
+            make('C++={0}'.format(spack_cxx), 'CPP={0}'.format(spack_cxx),
+                 'libgurobi_c++.a')
+            copy('libgurobi_c++.a', join_path('..', '..', 'lib'))
+
+        copy_tree_parallel('linux64', join_path(prefix, 'linux64'),
+                           jobs=make_jobs)
+
+        if '+python' in spec:
+            with working_dir('linux64'):
+                setup_py('install', '--prefix={0}'.format(prefix))
+
+    @run_after('install')
+    def install_library_index(self):
+        if '+libindex' in self.spec:
+            link_library_index(self.prefix, self.lib_dirs)
+
+    @run_after('install')
+    def install_license(self):
+        if self.license_settings:
+            with open(join_path(self.prefix, 'gurobi.lic'), 'w') as f:
+                f.write('\n'.join(self.license_settings) + '\n')
+
+    @run_after('install')
+    def install_wrappers(self):
+        """Installs wrappers setting the Threads parameter to the CPUs per
+        task of the Slurm job, unless it is given on the command line.
+
+        Gurobi otherwise starts a thread per core of the node, which
+        oversubscribes it when many solves share it. Only the programs
+        can be capped this way, gurobi.env is read from the working
+        directory of the solve."""
+        mkdirp(self.prefix.bin)
+        for program in self.wrapped_programs:
+            write_threads_wrapper(
+                join_path(self.prefix.bin, program),
+                join_path(self.prefix, 'linux64', 'bin', program))
 
     @property
     def global_license_file(self):
@@ -64,9 +172,28 @@ class Gurobi(Package):
         common 'intel' directory."""
         return os.path.join(self.global_license_dir, 'gurobi', 'gurobi.lic')
 
+    def setup_dependent_environment(self, spack_env, run_env, dependent_spec):
+        spack_env.set('GUROBI_HOME', join_path(self.prefix, 'linux64'))
+        spack_env.prepend_path('CPATH',
+                               join_path(self.prefix, 'linux64', 'include'))
+        spack_env.prepend_path('CLASSPATH', join_path(self.prefix, 'linux64',
+                                                      'lib', 'gurobi.jar'))
+
     def setup_environment(self, spack_env, run_env):
-        run_env.set('GRB_LICENSE_FILE', self.global_license_file)
-        run_env.set('GUROBI_HOME', join_path(prefix, 'linux64'))
-        run_env.prepend_path('PATH', join_path(prefix, 'linux64', 'bin'))
-        run_env.prepend_path('LD_LIBRARY_PATH', join_path(prefix, 'linux64',
-                                                          'lib'))
+        if self.license_settings:
+            run_env.set('GRB_LICENSE_FILE',
+                        join_path(self.prefix, 'gurobi.lic'))
+        else:
+            run_env.set('GRB_LICENSE_FILE', self.global_license_file)
+        run_env.set('GUROBI_HOME', join_path(self.prefix, 'linux64'))
+        run_env.prepend_path('PATH', join_path(self.prefix, 'linux64', 'bin'))
+        run_env.prepend_path('PATH', self.prefix.bin)
+        run_env.prepend_path('CLASSPATH',
+                             join_path(self.prefix, 'linux64', 'lib',
+                                       'gurobi.jar'))
+        index = join_path(self.prefix, LIBRARY_INDEX)
+        if '+libindex' in self.spec and os.path.isdir(index):
+            run_env.prepend_path('LD_LIBRARY_PATH', index)
+        else:
+            run_env.prepend_path('LD_LIBRARY_PATH',
+                                 join_path(self.prefix, 'linux64', 'lib'))
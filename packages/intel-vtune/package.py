@@ -1,7 +1,8 @@
 from spack import *
+from spack.pkg.scitasexternal.binary_payload import BinaryPayload
 
 
-class IntelVtune(Package):
+class IntelVtune(BinaryPayload):
     """
     Intel Vtune profiler
     """
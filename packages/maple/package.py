@@ -38,6 +38,10 @@
 # please first remove this boilerplate and all FIXME comments.
 #
 from spack import *
+from spack.pkg.scitasexternal.binary_payload import (LIBRARY_INDEX,
+                                                     link_library_index)
+
+import os
 
 
 class Maple(Package):
@@ -56,6 +60,10 @@ Maple is an interpreted language."""
 
     version('2017')
 
+    variant('libindex', default=False,
+            description='Resolve shared libraries through a per-install '
+                        'index instead of a LD_LIBRARY_PATH chain')
+
     # Licensing
     license_required = True
     license_comment = '#'
@@ -63,13 +71,23 @@ Maple is an interpreted language."""
     license_vars     = ['LM_LICENSE_FILE']
     license_url = "https://www.maplesoft.com/products/Maple/"
 
+    lib_dirs = ['/ssoft/spack/external/Maple/2017/lib']
+
     def install(self, spec, prefix):
         pass
 
+    @run_after('install')
+    def install_library_index(self):
+        if '+libindex' in self.spec:
+            link_library_index(self.prefix, self.lib_dirs)
+
     def setup_environment(self, spack_env, run_env):
         run_env.prepend_path('PATH', '/ssoft/spack/external/Maple/2017/bin')
-        run_env.prepend_path('LD_LIBRARY_PATH',
-                             '/ssoft/spack/external/Maple/2017/lib')
+        index = join_path(self.prefix, LIBRARY_INDEX)
+        if '+libindex' in self.spec and os.path.isdir(index):
+            run_env.prepend_path('LD_LIBRARY_PATH', index)
+        else:
+            run_env.prepend_path('LD_LIBRARY_PATH', ':'.join(self.lib_dirs))
         run_env.prepend_path('MANPATH', '/ssoft/spack/external/Maple/2017/man')
 
     def setup_dependent_environment(self, spack_env, run_env, dependent_spec):
@@ -23,9 +23,10 @@
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
 ##############################################################################
 from spack import *
+from spack.pkg.scitasexternal.binary_payload import BinaryPayload
 
 
-class Mathematica(Package):
+class Mathematica(BinaryPayload):
     """Mathematica is a symbolic mathematics program.
 
     There are a number of ways to use it:
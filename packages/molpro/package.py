@@ -4,8 +4,57 @@
 # SPDX-License-Identifier: (Apache-2.0 OR MIT)
 
 from spack import *
+from spack.pkg.scitasexternal.binary_payload import (scratch_chain,
+                                                     write_script)
+
 import os
 
+# Wrapper running molpro with the defaults of the Slurm job it runs in, the
+# options given by the user come after them and take precedence.
+_molpro_wrapper = """#!/bin/bash
+OPTIONS=({options})
+if [ -n "$SLURM_JOB_ID" ]; then
+{helper}    SCRATCH={scratch}
+    if [ -n "$SCRATCH" ]; then
+        OPTIONS+=(-d "$SCRATCH")
+    fi
+fi
+
+exec "{molpro}" "${{OPTIONS[@]}}" "$@"
+"""
+
+# One helper server per node, with as many tasks per node as the job
+_node_helper = """    if [ -n "$SLURM_NTASKS_PER_NODE" ]; then
+        OPTIONS+=(--multiple-helper-server "$SLURM_NTASKS_PER_NODE")
+    fi
+"""
+
+
+def launcher_line(launcher, srun_options):
+    """Returns the LAUNCHER line of CONFIG for a launcher, %x being the
+    Molpro executable and %n the number of processes."""
+    if launcher == 'srun':
+        return ' '.join(['srun'] + list(srun_options) + ['%x'])
+    return 'mpiexec -np %n %x'
+
+
+def set_launcher(config, line):
+    """Sets the LAUNCHER of a Molpro CONFIG file."""
+    filter_file(r'^LAUNCHER=.*', 'LAUNCHER=%s' % line, config)
+
+
+def write_molpro_wrapper(path, molpro, helper, scratch_variables):
+    """Writes the molpro wrapper to path, running molpro with the helper
+    servers of helper and the scratch in the first of scratch_variables
+    that is set."""
+    # make install may have put a link to the real molpro there, which
+    # write_script replaces
+    write_script(path, _molpro_wrapper.format(
+        options='--no-helper-server' if helper == 'none' else '',
+        helper=_node_helper if helper == 'node' else '',
+        scratch=scratch_chain(scratch_variables),
+        molpro=molpro))
+
 
 class Molpro(Package):
     """Molpro is an ab initio program for electronic structure calculations."""
@@ -17,15 +66,43 @@ class Molpro(Package):
     version('2015.1', sha256='a51df73acd54911fcc2d468ffa66676fb83117bb4e463eefe22dcaba4645c477')
 
     variant('mpi', default=True, description='Build with MPI support')
+    variant('ilp64', default=True,
+            description='Use 64-bit integers (the _i8 build of Molpro)')
+    variant('launcher', default='srun', values=('srun', 'mpiexec'),
+            description='Launcher written to CONFIG for parallel runs')
+    variant('helper', default='single', values=('single', 'node', 'none'),
+            description='Helper servers of the MPI-2 PPIDD layer: one per '
+                        'job, one per node or none')
+    variant('ga', default=False,
+            description='Use Global Arrays instead of the MPI-2 PPIDD layer')
+    variant('comex', default='mpi-pr',
+            values=('mpi-pr', 'mpi-ts', 'mpi3', 'openib', 'ofi'),
+            description='ComEx backend of Global Arrays')
 
     depends_on('blas')
     depends_on('lapack')
+    # The integer size of BLAS and LAPACK has to match the one of Molpro
+    depends_on('intel-mkl+ilp64', when='+ilp64 ^intel-mkl')
+    depends_on('openblas+ilp64', when='+ilp64 ^openblas')
+    depends_on('intel-mkl~ilp64', when='~ilp64 ^intel-mkl')
+    depends_on('openblas~ilp64', when='~ilp64 ^openblas')
     depends_on('python@:3', when='@2019:')
 
     depends_on('mpi', when='+mpi')
     depends_on('mpi', when='@2019:')
     depends_on('eigen', when='@2019:')
     depends_on('libxml2')
+    depends_on('globalarrays', when='+ga')
+    for backend in ('mpi-pr', 'mpi-ts', 'mpi3', 'openib', 'ofi'):
+        depends_on('globalarrays armci=%s' % backend,
+                   when='+ga comex=%s' % backend)
+
+    # Global Arrays is only supported from 2019 on, and always runs on MPI
+    # without the helper servers of the MPI-2 layer
+    conflicts('+ga', when='@:2018')
+    conflicts('+ga', when='~mpi')
+    conflicts('helper=node', when='+ga')
+    conflicts('helper=none', when='+ga')
 
     conflicts('python@:3')
     # For a successful installation of Molpro either the environment variable
@@ -35,10 +112,37 @@ class Molpro(Package):
     # contact their server and it asks for user name and password). During
     # runtime a valid key is needed (in the file lib/.token).
 
+    # Options of srun binding each process to its cores, with consecutive
+    # ranks on the same node
+    srun_options = ['--cpu-bind=cores', '--distribution=block:block']
+
+    # Variables holding node-local scratch, in order of preference
+    scratch_variables = ['SLURM_TMPDIR', 'TMPDIR']
+
+    @property
+    def launcher(self):
+        return launcher_line(self.spec.variants['launcher'].value,
+                             self.srun_options)
+
+    @property
+    def molpro_bin(self):
+        if self.version < Version('2019'):
+            dir_base_name='molprop'
+        else:
+            dir_base_name='molpro'
+        integer_size = 'i8' if self.spec.satisfies('+ilp64') else 'i4'
+        directory='{0}_{1}_linux_x86_64_{2}'.format(dir_base_name,
+                                                    self.version.up_to(2).underscored,
+                                                    integer_size)
+        return join_path(self.prefix, directory, 'bin')
+
     def install(self, spec, prefix):
         options = ['--prefix=%s' % prefix]
 
-        options.append("--with-blas=" % spec['blas'].libs)
+        options.append('--with-blas=%s' % spec['blas'].libs.ld_flags)
+        options.append('--with-lapack=%s' % spec['lapack'].libs.ld_flags)
+        if spec.satisfies('~ilp64'):
+            options.append('--disable-integer8')
 
         if 'mpi' in spec:
             options.append('FC=%s' % spec['mpi'].mpifc)
@@ -51,6 +155,8 @@ class Molpro(Package):
                 if spec.satisfies('%gcc@10:'):
                     options.append('F90FLAGS=-ffree-line-length-none -fallow-argument-mismatch')
 
+            elif spec.satisfies('+ga'):
+                options.append('--with-ga=%s' % spec['globalarrays'].prefix)
             else:
                 options.append('--without-ga')
         configure(*options)
@@ -61,22 +167,24 @@ class Molpro(Package):
         # Molpro wants to use a variation of mpirun during the installation.
         # We need to change the LAUNCHER in CONFIG to something not MPI
         # dependent to avoid problems with Slurm.
-        filter_file(r'^LAUNCHER=.*', 'LAUNCHER=%x', 'CONFIG')
+        set_launcher('CONFIG', '%x')
         make()
 
-        # Before the installation we change the launcher to srun (%x is the
-        # Molpro executable itself) to conform to our cluster.
-        filter_file(r'^LAUNCHER=.*', 'LAUNCHER=srun %x', 'CONFIG')
-
+        # Before the installation we change the launcher to the one of the
+        # spec to conform to our cluster.
+        set_launcher('CONFIG', self.launcher)
 
         make('install')
 
+    @run_after('install')
+    def install_wrapper(self):
+        """Installs the molpro wrapper setting the options of the job."""
+        mkdirp(self.prefix.bin)
+        write_molpro_wrapper(join_path(self.prefix.bin, 'molpro'),
+                             join_path(self.molpro_bin, 'molpro'),
+                             self.spec.variants['helper'].value,
+                             self.scratch_variables)
+
     def setup_environment(self, spack_env, run_env):
-        if self.version < Version('2019'):
-            dir_base_name='molprop'
-        else:
-            dir_base_name='molpro'
-        directory='{0}_{1}_linux_x86_64_i8'.format(dir_base_name,
-                                                   self.version.up_to(2).underscored)
-        run_env.prepend_path('PATH', join_path(self.prefix,
-                             directory, 'bin'))
+        run_env.prepend_path('PATH', self.molpro_bin)
+        run_env.prepend_path('PATH', self.prefix.bin)
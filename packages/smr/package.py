@@ -23,9 +23,10 @@
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307 USA
 ##############################################################################
 from spack import *
+from spack.pkg.scitasexternal.binary_payload import BinaryPayload
 
 
-class Smr(Package):
+class Smr(BinaryPayload):
     """SMR is a tools suite specially built and configured on the sole
     usage of Penelope Leyland.
     """
@@ -4,9 +4,11 @@
 # SPDX-License-Identifier: (Apache-2.0 OR MIT)
 
 from spack import *
+from spack.pkg.scitasexternal.binary_payload import (BinaryPayload,
+                                                     existing_paths)
 
 
-class Terachem(Package):
+class Terachem(BinaryPayload):
     """TeraChem is general purpose quantum chemistry software designed to
        run on NVIDIA GPUs."""
 
@@ -16,6 +18,11 @@ class Terachem(Package):
 
     version('1.96H-beta')
 
+    @property
+    def lib_dirs(self):
+        return existing_paths(str(self.prefix),
+                               (join_path(self.prefix, 'TeraChem', 'lib'),))
+
     def install(self, spec, prefix):
         pass
 
@@ -25,5 +32,8 @@ class Terachem(Package):
         run_env.set('TeraChem', tera_root)
         run_env.set('NBOEXE', join_path(tera_root, 'bin', 'nbo6.i4.exe'))
 
-        run_env.prepend_path('LD_LIBRARY_PATH', join_path(tera_root, 'lib'))
-        run_env.prepend_path('PATH', join_path(tera_root, 'bin'))
+        if self.lib_dirs:
+            run_env.prepend_path('LD_LIBRARY_PATH', ':'.join(self.lib_dirs))
+        for bin_dir in existing_paths(str(self.prefix),
+                                       (join_path(tera_root, 'bin'),)):
+            run_env.prepend_path('PATH', bin_dir)
@@ -0,0 +1,57 @@
+##############################################################################
+# Tests of the scripts and helpers of the packages in this repository.
+#
+# Run them with the repository registered in Spack:
+#
+#     spack python -m pytest tests
+#
+# The package modules are imported from spack.pkg.scitasexternal, the tests
+# of a package are skipped when it cannot be imported.
+##############################################################################
+import os
+import subprocess
+
+import pytest
+
+
+@pytest.fixture
+def stub(tmp_path):
+    """Returns a function writing an executable to a path relative to the
+    temporary directory, which prints its arguments and the value of the
+    variables named, one per line."""
+    def write(relative, variables=()):
+        path = tmp_path / relative
+        path.parent.mkdir(parents=True, exist_ok=True)
+        lines = ['#!/bin/sh', 'for arg; do echo "arg=$arg"; done']
+        lines.extend('echo "{0}=${{{0}-unset}}"'.format(variable)
+                     for variable in variables)
+        path.write_text('\n'.join(lines) + '\n')
+        path.chmod(0o755)
+        return str(path)
+    return write
+
+
+@pytest.fixture
+def run(tmp_path):
+    """Returns a function running a command in a fixed environment, made of
+    a minimal PATH with the stub bin directory first and the given
+    variables. The output is returned as a dict of the variables printed
+    and a list of the arguments."""
+    def run_command(command, env=None):
+        full_env = {
+            'PATH': os.pathsep.join([str(tmp_path / 'bin'), '/usr/bin',
+                                     '/bin']),
+        }
+        full_env.update(env or {})
+        output = subprocess.check_output(command, env=full_env,
+                                         cwd=str(tmp_path))
+        variables = {}
+        args = []
+        for line in output.decode().splitlines():
+            name, _, value = line.partition('=')
+            if name == 'arg':
+                args.append(value)
+            else:
+                variables[name] = value
+        return variables, args
+    return run_command
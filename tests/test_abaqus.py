@@ -0,0 +1,64 @@
+import os
+
+import pytest
+
+abaqus = pytest.importorskip('spack.pkg.scitasexternal.abaqus')
+
+
+def evaluate(tmp_path, monkeypatch, env):
+    """Evaluates the Slurm settings as Abaqus does, in the environment of a
+    job on the nodes n1 and n2. Returns the settings defined."""
+    scontrol = tmp_path / 'scontrol'
+    scontrol.write_text('#!/bin/sh\necho n1\necho n2\n')
+    scontrol.chmod(0o755)
+    monkeypatch.setenv('PATH', os.pathsep.join([str(tmp_path), '/usr/bin',
+                                                '/bin']))
+    for name in list(os.environ):
+        if name.startswith('SLURM_') or name == 'TMPDIR':
+            monkeypatch.delenv(name)
+    for name, value in env.items():
+        monkeypatch.setenv(name, value)
+
+    settings = {'MPI': 'MPI'}
+    exec(abaqus.site_settings(0.9, ['SLURM_TMPDIR', 'TMPDIR']), settings)
+    return settings
+
+
+@pytest.mark.parametrize('env,cpus,hosts', [
+    ({'SLURM_NTASKS': '8', 'SLURM_TASKS_PER_NODE': '4(x2)'},
+     8, [['n1', 4], ['n2', 4]]),
+    ({'SLURM_NTASKS': '4', 'SLURM_CPUS_PER_TASK': '4',
+      'SLURM_TASKS_PER_NODE': '3,1'},
+     16, [['n1', 12], ['n2', 4]]),
+    ({'SLURM_NTASKS': '2', 'SLURM_CPUS_PER_TASK': '8',
+      'SLURM_TASKS_PER_NODE': '1(x2)'},
+     16, [['n1', 8], ['n2', 8]]),
+])
+def test_cpus_match_hosts(tmp_path, monkeypatch, env, cpus, hosts):
+    env = dict(env, SLURM_JOB_NODELIST='n[1-2]')
+    settings = evaluate(tmp_path, monkeypatch, env)
+    assert settings['cpus'] == cpus
+    assert settings['mp_host_list'] == hosts
+    assert sum(count for _, count in settings['mp_host_list']) == cpus
+
+
+def test_outside_job(tmp_path, monkeypatch):
+    settings = evaluate(tmp_path, monkeypatch, {'SLURM_NTASKS': '8'})
+    assert 'cpus' not in settings
+    assert 'mp_host_list' not in settings
+
+
+def test_site_settings_merged(tmp_path):
+    site = tmp_path / 'SMA' / 'site'
+    site.mkdir(parents=True)
+    (site / 'abaqus_v6.env').write_text("license_server_type=FLEXNET\n")
+    package = abaqus.Abaqus.__new__(abaqus.Abaqus)
+    package.prefix = str(tmp_path)
+
+    # Once when installed, then when the manifest is recorded
+    package.install_scripts()
+    package.install_scripts()
+    lines = (site / 'abaqus_v6.env').read_text().splitlines()
+    assert lines[0] == 'license_server_type=FLEXNET'
+    assert lines.count(abaqus._site_settings_begin) == 1
+    assert lines[-1] == abaqus._site_settings_end
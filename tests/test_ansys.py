@@ -0,0 +1,70 @@
+import os
+import subprocess
+
+import pytest
+
+ansys = pytest.importorskip('spack.pkg.scitasexternal.ansys')
+
+job = {'SLURM_JOB_NODELIST': 'n[1-2]', 'SLURM_NTASKS': '12',
+       'SLURM_TASKS_PER_NODE': '8,4'}
+
+try:
+    interconnect = ('infiniband' if os.listdir('/sys/class/infiniband')
+                    else 'ethernet')
+except OSError:
+    interconnect = 'ethernet'
+
+
+@pytest.fixture
+def launchers(tmp_path, stub):
+    """Writes the launchers of an installation of solver stubs, and a
+    scontrol stub of a job on the nodes n1 and n2. The fluent stub also
+    prints the content of the host file it is given."""
+    stub('ansys/CFX/bin/cfx5solve', ['I_MPI_PIN', 'I_MPI_PIN_DOMAIN'])
+    fluent = tmp_path / 'ansys' / 'fluent' / 'bin' / 'fluent'
+    fluent.parent.mkdir(parents=True)
+    fluent.write_text('#!/bin/sh\n'
+                      'for arg; do\n'
+                      '    echo "arg=$arg"\n'
+                      '    case "$arg" in\n'
+                      '        -cnf=*) echo "hosts=$(paste -sd , '
+                      '"${arg#-cnf=}")" ;;\n'
+                      '    esac\n'
+                      'done\n')
+    fluent.chmod(0o755)
+    scontrol = tmp_path / 'bin' / 'scontrol'
+    scontrol.parent.mkdir()
+    scontrol.write_text('#!/bin/sh\necho n1\necho n2\n')
+    scontrol.chmod(0o755)
+
+    bin_dir = tmp_path / 'launchers'
+    bin_dir.mkdir()
+    ansys.write_launchers(str(bin_dir), str(tmp_path / 'ansys'))
+    return bin_dir
+
+
+def test_fluent(launchers, run):
+    found, args = run([str(launchers / 'fluent-slurm'), '3ddp', '-i',
+                       'run.jou'], job)
+    assert found == {'hosts': 'n1:8,n2:4'}
+    assert args[:3] == ['3ddp', '-i', 'run.jou']
+    assert args[3:5] == ['-g', '-t12']
+    assert args[5].startswith('-cnf=')
+    assert args[6:] == ['-p' + interconnect, '-mpi=intel']
+
+
+@pytest.mark.parametrize('cpus,domain', [(None, 'core'), ('4', '4')])
+def test_cfx(launchers, run, cpus, domain):
+    env = dict(job)
+    if cpus:
+        env['SLURM_CPUS_PER_TASK'] = cpus
+    found, args = run([str(launchers / 'cfx5solve-slurm'), '-def',
+                       'case.def'], env)
+    assert args == ['-def', 'case.def', '-par-dist', 'n1*8,n2*4',
+                    '-start-method', 'Intel MPI Distributed Parallel']
+    assert found == {'I_MPI_PIN': '1', 'I_MPI_PIN_DOMAIN': domain}
+
+
+def test_outside_job(launchers, run):
+    with pytest.raises(subprocess.CalledProcessError):
+        run([str(launchers / 'fluent-slurm')], {})
@@ -0,0 +1,49 @@
+import pytest
+
+cfdplusplus = pytest.importorskip('spack.pkg.scitasexternal.cfdplusplus')
+
+variables = ('MCFD_MAXMEM', 'MCFD_PROCMEM')
+
+
+@pytest.fixture
+def mcfd(tmp_path, stub):
+    """Writes the wrapper in front of a mcfd stub, on a node of 192 GB."""
+    meminfo = tmp_path / 'meminfo'
+    meminfo.write_text('MemTotal:       196608000 kB\n'
+                       'MemFree:        190000000 kB\n')
+    wrapper = str(tmp_path / 'mcfd')
+    cfdplusplus.write_memory_wrapper(
+        wrapper, stub('mlib/mcfd.19.1/exec/mcfd', variables), 0.9,
+        meminfo=str(meminfo))
+    return wrapper
+
+
+@pytest.mark.parametrize('job,maximum,per_process', [
+    # Outside of a job the defaults of CFD++ apply
+    ({'SLURM_MEM_PER_NODE': '100000'}, 'unset', 'unset'),
+    # Whole node, one process per task
+    ({'SLURM_JOB_ID': '1', 'SLURM_MEM_PER_NODE': '100000',
+      'SLURM_NTASKS_PER_NODE': '4'}, '90000M', '22500M'),
+    # Memory per CPU, tasks per node only known from the layout
+    ({'SLURM_JOB_ID': '1', 'SLURM_MEM_PER_CPU': '4000',
+      'SLURM_CPUS_ON_NODE': '8', 'SLURM_TASKS_PER_NODE': '8(x2)'},
+     '28800M', '3600M'),
+    ({'SLURM_JOB_ID': '1', 'SLURM_MEM_PER_NODE': '64000',
+      'SLURM_TASKS_PER_NODE': '3,2'}, '57600M', '19200M'),
+    # A single task when the tasks per node are not known
+    ({'SLURM_JOB_ID': '1', 'SLURM_MEM_PER_NODE': '1000'}, '900M', '900M'),
+    # No memory limit in the job, the memory of the node is used
+    ({'SLURM_JOB_ID': '1', 'SLURM_NTASKS_PER_NODE': '4'},
+     '172800M', '43200M'),
+])
+def test_allocations(mcfd, run, job, maximum, per_process):
+    found, args = run([mcfd, 'solve'], job)
+    assert args == ['solve']
+    assert found == {'MCFD_MAXMEM': maximum, 'MCFD_PROCMEM': per_process}
+
+
+def test_user_settings_win(mcfd, run):
+    found, _ = run([mcfd], {
+        'SLURM_JOB_ID': '1', 'SLURM_MEM_PER_NODE': '100000',
+        'SLURM_NTASKS_PER_NODE': '4', 'MCFD_MAXMEM': '2000M'})
+    assert found == {'MCFD_MAXMEM': '2000M', 'MCFD_PROCMEM': '22500M'}
@@ -0,0 +1,47 @@
+import pytest
+
+comsol = pytest.importorskip('spack.pkg.scitasexternal.comsol')
+
+
+@pytest.fixture
+def wrapper(tmp_path, stub):
+    """Writes comsol-slurm in front of a comsol stub, with a srun stub
+    printing the command it would run on each node."""
+    srun = tmp_path / 'bin' / 'srun'
+    srun.parent.mkdir()
+    srun.write_text('#!/bin/sh\necho "srun=$*"\n')
+    srun.chmod(0o755)
+    path = str(tmp_path / 'comsol-slurm')
+    comsol.write_slurm_wrapper(path, stub('comsol/bin/comsol'),
+                               comsol._slurm_bootstrap,
+                               ['SLURM_TMPDIR', 'TMPDIR'])
+    return path
+
+
+def test_single_node(tmp_path, wrapper, run):
+    scratch = tmp_path / 'local'
+    found, args = run([wrapper, 'batch', '-inputfile', 'model.mph'],
+                      {'SLURM_TMPDIR': str(scratch),
+                       'SLURM_CPUS_PER_TASK': '8'})
+    assert 'srun' not in found
+    assert (scratch / 'comsol-tmp').is_dir()
+    assert (scratch / 'comsol-recovery').is_dir()
+    assert args == ['batch', '-inputfile', 'model.mph',
+                    '-tmpdir', str(scratch / 'comsol-tmp'),
+                    '-recoverydir', str(scratch / 'comsol-recovery'),
+                    '-np', '8']
+
+
+def test_cluster(wrapper, run):
+    found, args = run([wrapper, 'batch'], {
+        'SLURM_TMPDIR': '/local/job', 'SLURM_JOB_NUM_NODES': '2',
+        'SLURM_NTASKS': '4', 'SLURM_NTASKS_PER_NODE': '2',
+        'SLURM_CPUS_PER_TASK': '16'})
+    # The directories are created on both nodes
+    assert found['srun'] == ('--ntasks=2 --ntasks-per-node=1 mkdir -p '
+                             '/local/job/comsol-tmp '
+                             '/local/job/comsol-recovery')
+    assert args == ['batch', '-tmpdir', '/local/job/comsol-tmp',
+                    '-recoverydir', '/local/job/comsol-recovery',
+                    '-np', '16', '-nn', '4', '-nnhost', '2',
+                    '-mpibootstrap', 'slurm']
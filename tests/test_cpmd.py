@@ -0,0 +1,83 @@
+import pytest
+
+cpmd = pytest.importorskip('spack.pkg.scitasexternal.cpmd')
+
+# A small tree laid out as CPMD 4.1, with modules in *.mod.F90 files
+sources = {
+    'kinds.mod.F90': 'MODULE kinds\n  INTEGER, PARAMETER :: real_8 = 8\n'
+                     'END MODULE kinds\n',
+    'error_handling.mod.F90': 'MODULE error_handling\n  USE kinds, ONLY: '
+                              'real_8\nEND MODULE error_handling\n',
+    'system.mod.F90': 'module system ! parameters of the run\n'
+                      '  use kinds\n  use error_handling, only: stopgm\n'
+                      '  interface sum\n    module procedure sum_r\n'
+                      '  end interface\nend module system\n',
+    'cpmd.F90': 'PROGRAM cpmd\n  USE, INTRINSIC :: iso_c_binding\n'
+                '  USE system\n  USE kinds\nEND PROGRAM cpmd\n',
+    'utils.F90': 'SUBROUTINE utils\n  USE::kinds\nEND SUBROUTINE utils\n',
+    'timer.f': '      SUBROUTINE TIMER\n      END\n',
+}
+
+makefile = """OBJ_MOD = kinds.mod.o error_handling.mod.o \\
+    system.mod.o
+OBJ_CPMD = cpmd.o timer.o
+cpmd.x: $(OBJ_MOD) $(OBJ_CPMD)
+\t$(LD) -o $@ $^
+%.o: %.F90
+\t$(FC) -c $<
+"""
+
+
+@pytest.fixture
+def tree(tmp_path):
+    src = tmp_path / 'src'
+    src.mkdir()
+    for name, text in sources.items():
+        (src / name).write_text(text)
+    (tmp_path / 'Makefile').write_text(makefile)
+    return tmp_path
+
+
+def path(tree, name):
+    return str(tree / 'src' / name)
+
+
+def test_module_dependencies(tree):
+    dependencies = cpmd.module_dependencies(
+        cpmd.fortran_sources(str(tree / 'src')))
+    assert dependencies == {
+        path(tree, 'error_handling.mod.F90'): [path(tree, 'kinds.mod.F90')],
+        path(tree, 'system.mod.F90'): [path(tree, 'error_handling.mod.F90'),
+                                       path(tree, 'kinds.mod.F90')],
+        path(tree, 'cpmd.F90'): [path(tree, 'kinds.mod.F90'),
+                                 path(tree, 'system.mod.F90')],
+        path(tree, 'utils.F90'): [path(tree, 'kinds.mod.F90')],
+    }
+
+
+def test_dependency_rules(tree):
+    # utils.o is not built by the makefile, so it gets no rule
+    rules = cpmd.dependency_rules(str(tree / 'Makefile'),
+                                  cpmd.fortran_sources(str(tree / 'src')))
+    assert sorted(rules) == [
+        'cpmd.o: kinds.mod.o system.mod.o',
+        'error_handling.mod.o: kinds.mod.o',
+        'system.mod.o: error_handling.mod.o kinds.mod.o',
+    ]
+
+
+def test_add_module_dependencies(tree):
+    count = cpmd.add_module_dependencies(
+        str(tree / 'Makefile'), cpmd.fortran_sources(str(tree / 'src')))
+    assert count == 3
+    text = (tree / 'Makefile').read_text()
+    assert text.startswith(makefile)
+    assert text.endswith('system.mod.o: error_handling.mod.o kinds.mod.o\n')
+
+
+def test_no_module(tmp_path):
+    (tmp_path / 'Makefile').write_text(makefile)
+    (tmp_path / 'timer.f').write_text(sources['timer.f'])
+    assert cpmd.add_module_dependencies(
+        str(tmp_path / 'Makefile'), [str(tmp_path / 'timer.f')]) == 0
+    assert (tmp_path / 'Makefile').read_text() == makefile
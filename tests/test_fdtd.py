@@ -0,0 +1,71 @@
+import pytest
+
+fdtd = pytest.importorskip('spack.pkg.scitasexternal.fdtd')
+
+# The versions of the package, oldest first
+versions = [
+    '8.12.527',
+    '8.18.1365-1',
+    '8.19.1416-1',
+    '8.20.1703',
+    '8.24.2387',
+    '2020-R2-2387',
+    '2020-R2.4-2502',
+    '2021-R2.2-2806',
+    '2022-R1.1-2963',
+]
+
+
+@pytest.mark.parametrize('version,expected', [
+    ('8.12.527', (8, (12,), 527)),
+    ('8.19.1416-1', (8, (19,), 1416)),
+    ('2020-R2-2387', (2020, (2,), 2387)),
+    ('2020-R2.4-2502', (2020, (2, 4), 2502)),
+    ('2022-R1.1-2963', (2022, (1, 1), 2963)),
+])
+def test_parse_version(version, expected):
+    assert fdtd.parse_version(version) == expected
+
+
+def test_release_order():
+    assert sorted(versions, key=fdtd.parse_version) == versions
+
+
+@pytest.mark.parametrize('version', ['2020R2', '8.24', 'R2-2387', ''])
+def test_unknown_version(version):
+    with pytest.raises(ValueError):
+        fdtd.parse_version(version)
+
+
+@pytest.mark.parametrize('version,shipped', [
+    ('8.19.1416-1', False),
+    ('8.20.1703', True),
+    ('2020-R2-2387', True),
+])
+def test_intel_mpi_engine(version, shipped):
+    _, since = fdtd._engines['intel-mpi']
+    assert (fdtd.parse_version(version) >= since) == shipped
+
+
+class _Spec(object):
+    """The parts of a concrete spec the engine is chosen from."""
+    def __init__(self, version, mpi):
+        self.version = version
+        self.mpi = type('Mpi', (object,), {'name': mpi})()
+
+    def __getitem__(self, name):
+        assert name == 'mpi'
+        return self.mpi
+
+
+@pytest.mark.parametrize('version,mpi', [
+    ('2022-R1.1-2963', 'cray-mpich'),
+    ('8.19.1416-1', 'intel-mpi'),
+])
+def test_no_engine_fails_install(version, mpi):
+    package = fdtd.Fdtd.__new__(fdtd.Fdtd)
+    package.spec = _Spec(version, mpi)
+    assert package.engine is None
+    with pytest.raises(fdtd.InstallError) as error:
+        package.install_scripts()
+    assert 'no engine for {0}'.format(mpi) in str(error.value)
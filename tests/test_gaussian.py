@@ -0,0 +1,101 @@
+import pytest
+
+gaussian = pytest.importorskip('spack.pkg.scitasexternal.gaussian')
+
+variables = ('GAUSS_SCRDIR', 'GAUSS_PDEF', 'GAUSS_MDEF', 'GAUSS_WDEF')
+
+
+@pytest.fixture
+def g16(tmp_path, stub):
+    """Writes the wrapper in front of a g16 stub, returns the command and
+    the g16root of the stub."""
+    stub('root/g16/g16', variables)
+    # scontrol show hostnames of a job on two nodes
+    scontrol = tmp_path / 'bin' / 'scontrol'
+    scontrol.parent.mkdir()
+    scontrol.write_text('#!/bin/sh\necho n1\necho n2\n')
+    scontrol.chmod(0o755)
+    wrapper = str(tmp_path / 'g16')
+    gaussian.write_g16_wrapper(wrapper, ['SLURM_TMPDIR', 'TMPDIR'], 0.8)
+    return wrapper, str(tmp_path / 'root')
+
+
+def test_outside_job(g16, run):
+    wrapper, root = g16
+    found, args = run([wrapper, 'input.com'],
+                      {'g16root': root, 'SLURM_CPUS_PER_TASK': '4',
+                       'TMPDIR': '/tmp'})
+    assert args == ['input.com']
+    assert all(found[variable] == 'unset' for variable in variables)
+
+
+@pytest.mark.parametrize('job,expected', [
+    ({'SLURM_CPUS_PER_TASK': '8', 'SLURM_MEM_PER_NODE': '10000',
+      'SLURM_TMPDIR': '/local/job', 'TMPDIR': '/tmp'},
+     {'GAUSS_SCRDIR': '/local/job', 'GAUSS_PDEF': '8',
+      'GAUSS_MDEF': '8000MB', 'GAUSS_WDEF': 'unset'}),
+    ({'SLURM_CPUS_PER_TASK': '4', 'SLURM_MEM_PER_CPU': '2000',
+      'TMPDIR': '/tmp'},
+     {'GAUSS_SCRDIR': '/tmp', 'GAUSS_PDEF': '4',
+      'GAUSS_MDEF': '6400MB', 'GAUSS_WDEF': 'unset'}),
+    ({'SLURM_JOB_NUM_NODES': '2', 'SLURM_JOB_NODELIST': 'n[1-2]'},
+     {'GAUSS_SCRDIR': 'unset', 'GAUSS_PDEF': 'unset',
+      'GAUSS_MDEF': 'unset', 'GAUSS_WDEF': 'n1,n2'}),
+])
+def test_job(g16, run, job, expected):
+    wrapper, root = g16
+    env = {'g16root': root, 'SLURM_JOB_ID': '1'}
+    env.update(job)
+    found, _ = run([wrapper], env)
+    assert found == expected
+
+
+def test_user_settings_win(g16, run):
+    wrapper, root = g16
+    found, _ = run([wrapper], {
+        'g16root': root, 'SLURM_JOB_ID': '1', 'SLURM_CPUS_PER_TASK': '8',
+        'SLURM_MEM_PER_NODE': '10000', 'SLURM_TMPDIR': '/local/job',
+        'GAUSS_PDEF': '2', 'GAUSS_MDEF': '1GB', 'GAUSS_SCRDIR': '/scratch'})
+    assert found['GAUSS_PDEF'] == '2'
+    assert found['GAUSS_MDEF'] == '1GB'
+    assert found['GAUSS_SCRDIR'] == '/scratch'
+
+
+@pytest.mark.parametrize('flags,installed,expected', [
+    # The fastest flavor installed the CPU supports
+    ('fpu avx avx2 avx512f', ['avx512', 'avx2'], 'avx512'),
+    ('fpu avx avx2', ['avx512', 'avx2'], 'avx2'),
+    ('fpu avx avx2 avx512f', ['avx2'], 'avx2'),
+    # The generic flavor of the module otherwise
+    ('fpu sse4_2', ['avx512', 'avx2'], 'generic'),
+    ('fpu avx2', [], 'generic'),
+])
+def test_flavor_per_node(tmp_path, stub, run, flags, installed, expected):
+    shown = ('g16root', 'GAUSS_BSDDIR', 'LD_LIBRARY_PATH')
+    roots = {'generic': tmp_path / 'prefix'}
+    stub('prefix/g16/g16', shown)
+    for name in installed:
+        roots[name] = tmp_path / 'prefix' / name
+        stub('prefix/{0}/g16/g16'.format(name), shown)
+    cpuinfo = tmp_path / 'cpuinfo'
+    cpuinfo.write_text('processor\t: 0\nflags\t\t: {0}\n'.format(flags))
+
+    wrapper = str(tmp_path / 'g16')
+    gaussian.write_g16_wrapper(
+        wrapper, ['TMPDIR'], 0.8,
+        [(flag, str(tmp_path / 'prefix' / subdir))
+         for _, flag, subdir in gaussian._flavors if flag],
+        cpuinfo=str(cpuinfo))
+    generic = str(roots['generic'])
+    found, _ = run([wrapper], {'g16root': generic,
+                               'GAUSS_BSDDIR': generic + '/g16/bsd',
+                               'LD_LIBRARY_PATH': '/opt/lib'})
+    root = str(roots[expected])
+    assert found['g16root'] == root
+    assert found['GAUSS_BSDDIR'] == root + '/g16/bsd'
+    if expected == 'generic':
+        assert found['LD_LIBRARY_PATH'] == '/opt/lib'
+    else:
+        assert found['LD_LIBRARY_PATH'].split(':') == [
+            root + '/g16', root + '/g16/bsd', root + '/g16/local',
+            '/opt/lib']
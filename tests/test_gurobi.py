@@ -0,0 +1,26 @@
+import pytest
+
+gurobi = pytest.importorskip('spack.pkg.scitasexternal.gurobi')
+
+
+@pytest.fixture
+def gurobi_cl(tmp_path, stub):
+    """Writes the wrapper in front of a gurobi_cl stub."""
+    wrapper = str(tmp_path / 'gurobi_cl')
+    gurobi.write_threads_wrapper(wrapper, stub('linux64/bin/gurobi_cl'))
+    return wrapper
+
+
+@pytest.mark.parametrize('env,args,expected', [
+    ({}, ['model.mps'], ['model.mps']),
+    ({'SLURM_CPUS_PER_TASK': '4'}, ['model.mps'],
+     ['Threads=4', 'model.mps']),
+    ({'SLURM_CPUS_PER_TASK': '4'}, ['Threads=2', 'model.mps'],
+     ['Threads=2', 'model.mps']),
+    ({'SLURM_CPUS_PER_TASK': '4'}, ['TimeLimit=60', 'threads=1', 'a b.mps'],
+     ['TimeLimit=60', 'threads=1', 'a b.mps']),
+    ({}, ['Threads=2', 'model.mps'], ['Threads=2', 'model.mps']),
+])
+def test_threads(gurobi_cl, run, env, args, expected):
+    _, found = run([gurobi_cl] + args, env)
+    assert found == expected
@@ -0,0 +1,78 @@
+import pytest
+
+molpro = pytest.importorskip('spack.pkg.scitasexternal.molpro')
+
+config = """# Molpro CONFIG
+FC=mpif90
+LAUNCHER=mpirun -np %n %x
+MPIBASE=/usr
+"""
+
+
+def parse_config(path):
+    with open(path) as f:
+        return dict(line.split('=', 1) for line in f.read().splitlines()
+                    if '=' in line and not line.startswith('#'))
+
+
+@pytest.mark.parametrize('launcher,srun_options,expected', [
+    ('srun', molpro.Molpro.srun_options,
+     'srun --cpu-bind=cores --distribution=block:block %x'),
+    ('srun', [], 'srun %x'),
+    ('mpiexec', molpro.Molpro.srun_options, 'mpiexec -np %n %x'),
+])
+def test_config_launcher(tmp_path, launcher, srun_options, expected):
+    path = str(tmp_path / 'CONFIG')
+    with open(path, 'w') as f:
+        f.write(config)
+
+    # As in install, %x alone while building, the spec's one to install
+    molpro.set_launcher(path, '%x')
+    assert parse_config(path)['LAUNCHER'] == '%x'
+    molpro.set_launcher(path, molpro.launcher_line(launcher, srun_options))
+
+    values = parse_config(path)
+    assert values['LAUNCHER'] == expected
+    assert values['FC'] == 'mpif90'
+    assert values['MPIBASE'] == '/usr'
+
+
+@pytest.fixture
+def wrapper(tmp_path, stub):
+    """Returns a function writing the wrapper for a helper setting, in front
+    of a molpro stub."""
+    real = stub('molpro/bin/molpro')
+
+    def write(helper):
+        path = str(tmp_path / 'molpro-{0}'.format(helper))
+        molpro.write_molpro_wrapper(path, real, helper,
+                                    ['SLURM_TMPDIR', 'TMPDIR'])
+        return path
+    return write
+
+
+job = {'SLURM_JOB_ID': '1', 'SLURM_NTASKS_PER_NODE': '16',
+       'SLURM_TMPDIR': '/local/job', 'TMPDIR': '/tmp'}
+
+
+@pytest.mark.parametrize('helper,env,expected', [
+    ('single', {'TMPDIR': '/tmp'}, []),
+    ('single', job, ['-d', '/local/job']),
+    ('none', {}, ['--no-helper-server']),
+    ('none', job, ['--no-helper-server', '-d', '/local/job']),
+    ('node', {'SLURM_NTASKS_PER_NODE': '16'}, []),
+    ('node', job, ['--multiple-helper-server', '16', '-d', '/local/job']),
+    ('node', {'SLURM_JOB_ID': '1', 'TMPDIR': '/tmp'}, ['-d', '/tmp']),
+])
+def test_wrapper(wrapper, run, helper, env, expected):
+    _, args = run([wrapper(helper), '-d', '/mine', 'input.inp'], env)
+    assert args == expected + ['-d', '/mine', 'input.inp']
+
+
+def test_wrapper_replaces_link(tmp_path, stub):
+    real = stub('molpro/bin/molpro')
+    link = tmp_path / 'bin-molpro'
+    link.symlink_to(real)
+    molpro.write_molpro_wrapper(str(link), real, 'single', ['TMPDIR'])
+    assert not link.is_symlink()
+    assert 'for arg' in open(real).read()
@@ -0,0 +1,174 @@
+import os
+
+import pytest
+
+binary_payload = pytest.importorskip(
+    'spack.pkg.scitasexternal.binary_payload')
+
+
+@pytest.fixture
+def payload(tmp_path):
+    """A payload of small files, a large one checked by samples and its
+    manifest. Returns the root and the manifest."""
+    root = tmp_path / 'payload'
+    (root / 'bin').mkdir(parents=True)
+    (root / 'lib' / 'sub').mkdir(parents=True)
+    (root / 'bin' / 'solver').write_bytes(b'solver' * 100)
+    (root / 'lib' / 'libsolver.so').write_bytes(b'library' * 100)
+    (root / 'lib' / 'sub' / 'data').write_bytes(b'data')
+    (root / 'large').write_bytes(os.urandom(4 * binary_payload._SAMPLE_BLOCK))
+    manifest = str(tmp_path / 'manifest')
+    binary_payload.write_manifest(str(root), manifest, jobs=2)
+    return root, manifest
+
+
+def _rewrite(path, content):
+    """Changes the content of a file but not its size and mtime."""
+    stat = path.stat()
+    path.write_bytes(content)
+    os.utime(str(path), ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+
+def problems(root, manifest, **kwargs):
+    return dict(
+        (os.path.relpath(path, str(root)), problem)
+        for path, problem in binary_payload.verify_manifest(
+            manifest, root=str(root), jobs=2, **kwargs))
+
+
+def test_intact(payload):
+    root, manifest = payload
+    assert problems(root, manifest) == {}
+    binary_payload.check_payload(manifest, root=str(root))
+
+
+def test_manifest_not_in_payload(tmp_path):
+    root = tmp_path / 'payload'
+    root.mkdir()
+    (root / 'file').write_bytes(b'content')
+    manifest = str(root / binary_payload.PAYLOAD_MANIFEST)
+    binary_payload.write_manifest(str(root), manifest)
+    assert [entry[0] for entry in binary_payload.read_manifest(manifest)] \
+        == ['file']
+
+
+def test_corrupted(payload):
+    root, manifest = payload
+    _rewrite(root / 'bin' / 'solver', b'SOLVER' * 100)
+    large = root / 'large'
+    content = bytearray(large.read_bytes())
+    content[0] ^= 0xff
+    _rewrite(large, bytes(content))
+
+    assert problems(root, manifest) == {
+        os.path.join('bin', 'solver'): 'content changed',
+        'large': 'content changed',
+    }
+    # Only the sizes and mtimes are compared without checksums
+    assert problems(root, manifest, check_hashes=False) == {}
+
+
+def test_truncated_deleted_and_touched(payload):
+    root, manifest = payload
+    (root / 'lib' / 'libsolver.so').write_bytes(b'library')
+    (root / 'lib' / 'sub' / 'data').unlink()
+    stat = (root / 'bin' / 'solver').stat()
+    os.utime(str(root / 'bin' / 'solver'),
+             ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+    assert problems(root, manifest, check_hashes=False) == {
+        os.path.join('lib', 'libsolver.so'): 'size changed',
+        os.path.join('lib', 'sub', 'data'): 'missing',
+        os.path.join('bin', 'solver'): 'modified',
+    }
+    with pytest.raises(binary_payload.InstallError) as error:
+        binary_payload.check_payload(manifest, root=str(root))
+    assert '3 files do not match' in str(error.value)
+
+
+def test_missing_manifest(tmp_path):
+    with pytest.raises(binary_payload.InstallError) as error:
+        binary_payload.check_payload(str(tmp_path / 'manifest'))
+    assert 'payload_manifest.py record' in str(error.value)
+
+
+def test_copy_and_resume(payload, tmp_path):
+    root, _ = payload
+    # Spack creates the prefix before installing
+    (tmp_path / 'prefix').mkdir()
+    dest = tmp_path / 'prefix' / 'payload'
+    manifest = str(tmp_path / 'prefix' / binary_payload.PAYLOAD_MANIFEST)
+    binary_payload.copy_tree_parallel(str(root), str(dest), jobs=2,
+                                      manifest=manifest)
+    assert problems(tmp_path / 'prefix', manifest) == {}
+
+    # A resumed copy skips the files already there and keeps the manifest
+    (dest / 'large').unlink()
+    binary_payload.copy_tree_parallel(str(root), str(dest), jobs=2,
+                                      manifest=manifest)
+    assert (dest / 'large').read_bytes() == (root / 'large').read_bytes()
+    assert problems(tmp_path / 'prefix', manifest) == {}
+
+
+def test_copy_keeps_directory_modes(payload, tmp_path):
+    root, _ = payload
+    (root / 'lib').chmod(0o750)
+    (root / 'lib' / 'sub').chmod(0o700)
+    dest = tmp_path / 'copy'
+    binary_payload.copy_tree_parallel(str(root), str(dest), jobs=2)
+    for path in ('lib', os.path.join('lib', 'sub'), 'bin'):
+        source = (root / path).stat()
+        copied = (dest / path).stat()
+        assert copied.st_mode == source.st_mode
+        assert copied.st_mtime_ns == source.st_mtime_ns
+
+
+def test_resume_removes_stale_partials(payload, tmp_path):
+    root, _ = payload
+    dest = tmp_path / 'copy'
+    (dest / 'lib').mkdir(parents=True)
+    # Left by a copy interrupted before the sources changed
+    (dest / 'lib' / 'removed.so.partial').write_bytes(b'lib')
+    (dest / 'lib' / 'libsolver.so.partial').write_bytes(b'lib')
+    binary_payload.copy_tree_parallel(str(root), str(dest), jobs=2)
+    assert sorted(os.listdir(str(dest / 'lib'))) == ['libsolver.so', 'sub']
+
+
+def test_write_script_replaces_link(tmp_path):
+    target = tmp_path / 'program'
+    target.write_text('program')
+    link = tmp_path / 'script'
+    link.symlink_to(target)
+    binary_payload.write_script(str(link), '#!/bin/sh\n')
+    assert not link.is_symlink()
+    assert os.access(str(link), os.X_OK)
+    assert target.read_text() == 'program'
+
+
+@pytest.mark.parametrize('variables,default,expected', [
+    (['SLURM_TMPDIR', 'TMPDIR'], '', '"${SLURM_TMPDIR:-${TMPDIR:-}}"'),
+    (['TMPDIR'], '/tmp', '"${TMPDIR:-/tmp}"'),
+    ([], '/tmp', '"/tmp"'),
+])
+def test_scratch_chain(variables, default, expected):
+    assert binary_payload.scratch_chain(variables, default) == expected
+
+
+@pytest.mark.parametrize('tasks,hosts', [
+    ('4(x2),3', ['n1:4', 'n2:4', 'n3:3']),
+    ('1,2,3', ['n1:1', 'n2:2', 'n3:3']),
+    ('16(x3)', ['n1:16', 'n2:16', 'n3:16']),
+])
+def test_slurm_hosts(tmp_path, run, tasks, hosts):
+    scontrol = tmp_path / 'bin' / 'scontrol'
+    scontrol.parent.mkdir()
+    scontrol.write_text('#!/bin/sh\necho n1\necho n2\necho n3\n')
+    scontrol.chmod(0o755)
+    script = tmp_path / 'hosts'
+    binary_payload.write_script(str(script), '#!/bin/bash\n{0}\n'
+                                'for arg in $(slurm_hosts :); do '
+                                'echo "arg=$arg"; done\n'.format(
+                                    binary_payload.SLURM_FUNCTIONS))
+    _, found = run([str(script)], {'SLURM_JOB_NODELIST': 'n[1-3]',
+                                   'SLURM_TASKS_PER_NODE': tasks})
+    assert found == hosts